@@ -0,0 +1,339 @@
+import os
+import sys
+import ast
+import json
+import time
+import heapq
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import toolchain
+import makefile_dry_run
+from records import Group
+from schedule import powermake_steps
+from shell_tokenizer import parse_command
+from synthetic import write_make_tree
+
+# Build a project with its Makefile and with the PowerMake generated from it, and compare them:
+# - the wall time of a build from clean (cold) and of a build with nothing to do (no-op), at several -j levels
+# - the commands run, normalized to (operation, file) -> defines, include dirs and flags
+# - the libraries and executables produced, with their exported symbols when nm is available
+# - the parallelism: how many steps the grouping needs compared to make, for the same number of jobs
+# The project is cleaned between the builds by removing every file that wasn't there before the first one.
+
+Snapshot = T.Tuple[T.Set[str], T.Set[str]]
+NormalizedCommands = T.Dict[T.Tuple[str, str], T.Dict[str, T.FrozenSet[str]]]
+
+
+def snapshot(folder: str) -> Snapshot:
+    dirs: T.Set[str] = set()
+    files: T.Set[str] = set()
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirs.update(os.path.join(dirpath, name) for name in dirnames)
+        files.update(os.path.join(dirpath, name) for name in filenames)
+    return dirs, files
+
+
+def new_files(folder: str, initial: Snapshot) -> T.List[str]:
+    return sorted(snapshot(folder)[1] - initial[1])
+
+
+def clean(folder: str, initial: Snapshot) -> None:
+    dirs, files = snapshot(folder)
+    for path in files - initial[1]:
+        os.remove(path)
+    for path in sorted(dirs - initial[0], key=len, reverse=True):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def timed_run(command: T.List[str], cwd: str) -> T.Tuple[float, str]:
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    duration = time.perf_counter() - start
+    output = result.stdout.decode(errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed in {cwd}:\n{output}")
+    return duration, output
+
+
+def artifact_name(path: str) -> str:
+    # liba.a, liba.so.1.2 and a all become `a`, the objects keep the name of their source
+    name = os.path.basename(path)
+    if ".so" in name:
+        name = name[:name.index(".so")]
+    elif name.endswith((".a", ".o")):
+        name = name[:-2]
+    if name.startswith("lib") and len(name) > 3:
+        name = name[3:]
+    return name
+
+
+def powermake_output_commands(output: str) -> T.Iterator[str]:
+    # PowerMake prints each command it runs as a Python list in verbose mode
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith('[') or not line.endswith(']'):
+            continue
+        try:
+            command = ast.literal_eval(line)
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(command, list) and all(isinstance(arg, str) for arg in command):
+            yield shlex.join(command)
+
+
+def tool_args(command: str) -> T.List[str]:
+    # The arguments of a command without its compiler launcher (ccache, distcc...), empty if it can't be parsed
+    try:
+        args = parse_command(command).args
+    except ValueError:
+        return []
+    if len(args) > 1 and main.is_launcher(args[0]):
+        return args[1:]
+    return args
+
+
+def normalize(entries: T.Iterable[T.Tuple[str, str]]) -> NormalizedCommands:
+    # The same compilation run by make and by PowerMake gets the same key, whatever the paths of the objects
+    commands: NormalizedCommands = {}
+    operation_type: str
+    flags: T.Sequence[T.Union[str, T.Tuple[str, ...]]]
+    for cwd, command in entries:
+        args = tool_args(command)
+        if len(args) == 0:
+            continue
+        kind = toolchain.binary_kind(args[0])
+        if kind == "compiler":
+            operation_type, defines, includedirs, flags, inputfiles, outputfile = main.extract_compiler_command(args, cwd)
+            if operation_type == "compile":
+                if len(inputfiles) == 0:
+                    continue
+                name = os.path.realpath(inputfiles[0])
+            elif outputfile is not None:
+                name = artifact_name(outputfile)
+            else:
+                continue
+        elif kind == "archiver":
+            operation_type, flags, _, outputfile = main.extract_archiver_command(args, cwd)
+            # The dry run merges ranlib into `ar -s`, the real build doesn't
+            flags = [flag for flag in flags if flag != "-s"]
+            defines, includedirs = [], []
+            if outputfile is None:
+                continue
+            name = artifact_name(outputfile)
+        else:
+            continue
+        commands[(operation_type, name)] = {
+            "defines": frozenset(defines),
+            "includedirs": frozenset(os.path.realpath(os.path.join(cwd, dir)) for dir in includedirs),
+            "flags": frozenset(flag if isinstance(flag, str) else ' '.join(flag) for flag in flags),
+        }
+    return commands
+
+
+def compare_commands(make_commands: NormalizedCommands, powermake_commands: NormalizedCommands) -> T.Dict[str, T.Any]:
+    differences = []
+    for key in sorted(set(make_commands) & set(powermake_commands)):
+        for field in ("defines", "includedirs", "flags"):
+            missing = make_commands[key][field] - powermake_commands[key][field]
+            added = powermake_commands[key][field] - make_commands[key][field]
+            if len(missing) > 0 or len(added) > 0:
+                differences.append({"command": list(key), "field": field, "missing": sorted(missing), "added": sorted(added)})
+    return {
+        "only_make": sorted(list(key) for key in set(make_commands) - set(powermake_commands)),
+        "only_powermake": sorted(list(key) for key in set(powermake_commands) - set(make_commands)),
+        "differences": differences,
+    }
+
+
+def artifacts(paths: T.Iterable[str]) -> T.Dict[str, str]:
+    # The libraries and the executables, by name
+    found = {}
+    for path in paths:
+        name = os.path.basename(path)
+        if name.endswith(".a") or ".so" in name:
+            found[artifact_name(path)] = path
+        elif not name.endswith(".o") and os.access(path, os.X_OK) and not os.path.islink(path):
+            with open(path, "rb") as file:
+                if file.read(4) == b"\x7fELF":
+                    found[artifact_name(path)] = path
+    return found
+
+
+def exported_symbols(path: str) -> T.Union[T.Set[str], None]:
+    if shutil.which("nm") is None:
+        return None
+    result = subprocess.run(["nm", "-g", "--defined-only", path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    return {line.split()[-1] for line in result.stdout.decode(errors="replace").splitlines() if len(line.split()) >= 3}
+
+
+def compare_artifacts(make_artifacts: T.Dict[str, str], powermake_artifacts: T.Dict[str, str]) -> T.Dict[str, T.Any]:
+    symbols_differences = {}
+    for name in sorted(set(make_artifacts) & set(powermake_artifacts)):
+        make_symbols = exported_symbols(make_artifacts[name])
+        powermake_symbols = exported_symbols(powermake_artifacts[name])
+        if make_symbols is not None and powermake_symbols is not None and make_symbols != powermake_symbols:
+            symbols_differences[name] = {"missing": sorted(make_symbols - powermake_symbols), "added": sorted(powermake_symbols - make_symbols)}
+    return {
+        "only_make": sorted(set(make_artifacts) - set(powermake_artifacts)),
+        "only_powermake": sorted(set(powermake_artifacts) - set(make_artifacts)),
+        "symbols_differences": symbols_differences,
+    }
+
+
+def make_steps(entries: T.Sequence[T.Tuple[str, str]], jobs: int) -> int:
+    # Number of steps make needs with `jobs` jobs if every command takes the same time,
+    # following the dependencies between the outputs and the inputs of the commands
+    producers: T.Dict[str, int] = {}
+    dependencies: T.List[T.Set[int]] = []
+    for cwd, command in entries:
+        args = tool_args(command)
+        if len(args) == 0:
+            continue
+        kind = toolchain.binary_kind(args[0])
+        if kind == "compiler":
+            _, _, _, _, inputfiles, outputfile = main.extract_compiler_command(args, cwd)
+        elif kind == "archiver":
+            _, _, inputfiles, outputfile = main.extract_archiver_command(args, cwd)
+        else:
+            continue
+        if outputfile is None or outputfile in producers:
+            continue
+        producers[outputfile] = len(dependencies)
+        dependencies.append({producers[file] for file in inputfiles if file in producers})
+
+    # The ready commands are started in the order make printed them
+    dependents: T.List[T.List[int]] = [[] for _ in dependencies]
+    for i, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(i)
+    waiting = [len(deps) for deps in dependencies]
+    ready = [i for i in range(len(dependencies)) if waiting[i] == 0]
+    steps = 0
+    while len(ready) > 0:
+        running = [heapq.heappop(ready) for _ in range(min(jobs, len(ready)))]
+        for i in running:
+            for dependent in dependents[i]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+        steps += 1
+    return steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the build of a project with its Makefile and with the generated PowerMake")
+    parser.add_argument("project", nargs="?", help="folder containing the Makefile, it must not be built yet")
+    parser.add_argument("--synthetic", metavar="TARGETSxSOURCES", help="build a synthetic GNU make project of this size instead")
+    parser.add_argument("--jobs", default=f"1,{os.cpu_count() or 1}", help="comma separated -j levels")
+    parser.add_argument("--repeat", type=int, default=1, help="keep the fastest of REPEAT builds")
+    parser.add_argument("--serialization-threshold", type=float, default=1.25, help="flag the translation when PowerMake needs this many times the steps (or the time) of make")
+    parser.add_argument("--parallel-stages", action="store_true", help="translate with --parallel-stages, the independent groups run at the same time")
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    args = parser.parse_args()
+    jobs_levels = [int(jobs) for jobs in args.jobs.split(',')]
+
+    workdir = None
+    if args.synthetic is not None:
+        targets, sources = (int(n) for n in args.synthetic.lower().split('x'))
+        workdir = tempfile.mkdtemp(prefix="makefile_to_powermake_build_")
+        folder = write_make_tree(workdir, targets, sources)
+    elif args.project is not None:
+        folder = os.path.abspath(args.project)
+    else:
+        parser.error("give a project folder or --synthetic")
+
+    try:
+        entries = makefile_dry_run.list_commands(["make"], folder, max(jobs_levels))
+        groups = T.cast(T.List[Group], main.create_compilation_groups(entries))
+        project_name, instructions_count, instructions = main.create_instructions(groups, parallel_stages=args.parallel_stages)
+        generated = os.path.join(folder, "generated.py")
+        with open(generated, "w") as file:
+            file.write(main.emit_code(project_name or "PROJECT_NAME", instructions_count, instructions))
+        initial = snapshot(folder)
+
+        report: T.Dict[str, T.Any] = {"project": folder, "entries": len(entries), "groups": len(groups), "jobs": {}}
+        has_powermake = importlib.util.find_spec("powermake") is not None
+        if not has_powermake:
+            print("powermake is not installed, only make is built")
+
+        make_commands = normalize(entries)
+        make_artifacts: T.Dict[str, str] = {}
+        powermake_commands: NormalizedCommands = {}
+        powermake_artifacts: T.Dict[str, str] = {}
+        for jobs in jobs_levels:
+            result: T.Dict[str, T.Any] = {"make_steps": make_steps(entries, jobs), "powermake_steps": powermake_steps(groups, jobs, args.parallel_stages)}
+            builds = [("make", ["make", f"-j{jobs}"])]
+            if has_powermake:
+                builds.append(("powermake", [sys.executable, generated, "-v", "-j", str(jobs)]))
+            for name, command in builds:
+                cold_times = []
+                noop_times = []
+                for _ in range(args.repeat):
+                    clean(folder, initial)
+                    duration, output = timed_run(command, folder)
+                    cold_times.append(duration)
+                    if name == "powermake":
+                        powermake_commands = normalize((folder, command) for command in powermake_output_commands(output))
+                        powermake_artifacts = artifacts(new_files(folder, initial))
+                    else:
+                        make_artifacts = artifacts(new_files(folder, initial))
+                    noop_times.append(timed_run(command, folder)[0])
+                result[name] = {"cold": min(cold_times), "noop": min(noop_times)}
+            clean(folder, initial)
+            report["jobs"][jobs] = result
+
+        if has_powermake:
+            report["commands"] = compare_commands(make_commands, powermake_commands)
+            report["artifacts"] = compare_artifacts(make_artifacts, powermake_artifacts)
+
+        # Serialization: the groups need more steps than make, or PowerMake gains less than make from more jobs
+        flags = []
+        base = report["jobs"][jobs_levels[0]]
+        for jobs in jobs_levels:
+            result = report["jobs"][jobs]
+            if result["powermake_steps"] > args.serialization_threshold * result["make_steps"]:
+                flags.append(f"-j{jobs}: the groups need {result['powermake_steps']} steps, make needs {result['make_steps']}")
+            if has_powermake and jobs != jobs_levels[0]:
+                make_speedup = base["make"]["cold"] / result["make"]["cold"]
+                powermake_speedup = base["powermake"]["cold"] / result["powermake"]["cold"]
+                if make_speedup > args.serialization_threshold * powermake_speedup:
+                    flags.append(f"-j{jobs}: make is {make_speedup:.2f}x faster than at -j{jobs_levels[0]}, PowerMake only {powermake_speedup:.2f}x")
+        report["serialization"] = flags
+
+        print(f"{folder}: {len(entries)} commands, {len(groups)} groups")
+        print(f"{'jobs':>6}{'make cold':>11}{'make no-op':>12}{'pm cold':>10}{'pm no-op':>10}{'make steps':>12}{'pm steps':>10}")
+        for jobs in jobs_levels:
+            result = report["jobs"][jobs]
+            line = f"{jobs:>6}{result['make']['cold']:>10.2f}s{result['make']['noop']:>11.2f}s"
+            if has_powermake:
+                line += f"{result['powermake']['cold']:>9.2f}s{result['powermake']['noop']:>9.2f}s"
+            else:
+                line += f"{'-':>10}{'-':>10}"
+            print(line + f"{result['make_steps']:>12}{result['powermake_steps']:>10}")
+        if has_powermake:
+            commands = report["commands"]
+            print(f"commands only run by make: {len(commands['only_make'])}, only by PowerMake: {len(commands['only_powermake'])}, with other flags: {len(commands['differences'])}")
+            for difference in commands["differences"][:10]:
+                print(f"  {difference['command'][1]} {difference['field']}: missing {difference['missing']} added {difference['added']}")
+            artifacts_comparison = report["artifacts"]
+            print(f"artifacts only built by make: {artifacts_comparison['only_make']}, only by PowerMake: {artifacts_comparison['only_powermake']}, with other symbols: {sorted(artifacts_comparison['symbols_differences'])}")
+        for flag in flags:
+            print(f"serialized: {flag}")
+
+        if args.json is not None:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir)
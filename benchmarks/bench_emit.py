@@ -0,0 +1,50 @@
+import os
+import sys
+import math
+import time
+import argparse
+import tempfile
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from synthetic import synthetic_entries
+
+# Time of create_instructions and of the emission of the generated PowerMake (written to a file like generate_code does)
+# on synthetic projects with tens of thousands of instructions, and how they grow with the number of instructions.
+
+
+def measure(targets: int, sources: int, directory: str) -> T.Dict[str, float]:
+    groups = main.create_compilation_groups(synthetic_entries(targets, sources))
+    start = time.perf_counter()
+    project_name, instructions_count, instructions = main.create_instructions(groups, [])
+    instructions_time = time.perf_counter() - start
+    path = os.path.join(directory, f"generated-{targets}x{sources}.py")
+    start = time.perf_counter()
+    with open(path, "w") as file:
+        main.write_code(file, project_name or "PROJECT_NAME", instructions_count, instructions)
+    emit_time = time.perf_counter() - start
+    return {"instructions": len(instructions), "create_instructions": instructions_time, "emit": emit_time, "bytes": os.path.getsize(path)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time of the emission of the generated PowerMake at large instruction counts")
+    parser.add_argument("--sizes", default="1000x3,4000x3,16000x3,32000x3", help="comma separated TARGETSxSOURCES, a target of 3 sources gives about 16 instructions")
+    args = parser.parse_args()
+
+    print(f"{'size':>10}{'instructions':>14}{'output':>11}{'create_instructions':>26}{'emit':>22}")
+    previous = None
+    with tempfile.TemporaryDirectory(prefix="makefile_to_powermake_emit_") as directory:
+        for size in args.sizes.split(','):
+            targets, sources = (int(n) for n in size.lower().split('x'))
+            result = measure(targets, sources, directory)
+            line = f"{size:>10}{result['instructions']:>14}{result['bytes'] / 2**20:>9.1f}Mi"
+            for stage, width in (("create_instructions", 26), ("emit", 22)):
+                cell = f"{result[stage]:.3f}s"
+                if previous is not None and previous[stage] > 0 and result[stage] > 0:
+                    # Exponent k of time ~ instructions**k, 1.00 is linear
+                    cell += f" (x^{math.log(result[stage] / previous[stage]) / math.log(result['instructions'] / previous['instructions']):.2f})"
+                line += f"{cell:>{width}}"
+            print(line)
+            previous = result
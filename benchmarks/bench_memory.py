@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from records import Group
+from synthetic import synthetic_entries
+
+# Peak memory of create_compilation_groups and create_instructions on a large synthetic trace, measured with tracemalloc.
+# The groups kept in memory are compared with the same groups stored as main.py did before records.py:
+# dicts with string keys, and every path split again from its own command instead of being interned.
+# The peaks can't be measured again without the old code, they were measured on the default trace before records.py:
+BEFORE_RECORDS = {"create_compilation_groups": 65.3 * 2**20, "create_instructions": 29.6 * 2**20}
+
+
+def copy_string(string: str) -> str:
+    return (string + " ")[:-1]
+
+
+def as_dicts(groups: T.List[Group]) -> T.List[T.Dict[str, T.Any]]:
+    # The files of a group kept the lists of their command, the group the ones of its first command
+    return [{
+        "operation_type": group.operation_type,
+        "defines": [copy_string(define) for define in group.defines],
+        "includedirs": [copy_string(includedir) for includedir in group.includedirs],
+        "args": [copy_string(arg) if isinstance(arg, str) else tuple(copy_string(word) for word in arg) for arg in group.args],
+        "files": [{"dependencies": [copy_string(dependency) for dependency in file.dependencies], "output": copy_string(file.output)} for file in group.files],
+        "command": group.command,
+        "command_cwd": group.command_cwd,
+    } for group in groups]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of the translator on a synthetic trace")
+    parser.add_argument("--targets", type=int, default=200)
+    parser.add_argument("--sources", type=int, default=250)
+    args = parser.parse_args()
+
+    entries = synthetic_entries(args.targets, args.sources)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    groups = T.cast(T.List[Group], main.create_compilation_groups(entries))
+    _, groups_peak = tracemalloc.get_traced_memory()
+    groups_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    project_name, instructions_count, instructions = main.create_instructions(groups)
+    _, instructions_peak = tracemalloc.get_traced_memory()
+    duration = time.perf_counter() - start
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    dicts = as_dicts(groups)
+    dicts_memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print(f"{len(entries)} entries, {len(groups)} groups, {len(instructions)} instructions in {duration:.2f} s")
+    print(f"{'':39}{'records':>12}{'before':>12}")
+    print(f"groups kept in memory:                 {groups_memory / 2**20:8.1f} MiB{dicts_memory / 2**20:8.1f} MiB (as dicts)")
+    print(f"create_compilation_groups peak memory: {groups_peak / 2**20:8.1f} MiB{BEFORE_RECORDS['create_compilation_groups'] / 2**20:8.1f} MiB (recorded)")
+    print(f"create_instructions peak memory:       {instructions_peak / 2**20:8.1f} MiB{BEFORE_RECORDS['create_instructions'] / 2**20:8.1f} MiB (recorded)")
@@ -0,0 +1,140 @@
+import os
+import sys
+import math
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+import dry_run_trace
+import makefile_dry_run
+from synthetic import LAYOUTS, synthetic_entries, use_fake_toolchain, write_tree
+
+# Time and peak memory of each stage of the translation on synthetic projects of growing size,
+# and how they grow with the number of commands (an exponent of 1.0 means linear).
+# The `make` and `cmake` layouts are written on disk and dry run with make, the compiler is not needed.
+# Without make, the `entries` layout or recorded traces (--traces) still measure everything after the dry run.
+
+STAGES = ["list_commands", "create_compilation_groups", "create_instructions", "emit_code"]
+
+
+def parse_size(size: str) -> T.Tuple[int, int]:
+    targets, sources = size.lower().split('x')
+    return int(targets), int(sources)
+
+
+def run_stages(get_entries: T.Callable[[], T.Sequence[T.Tuple[str, str]]], memory: bool) -> T.Tuple[int, T.Dict[str, T.Dict[str, float]]]:
+    results: T.Dict[str, T.Dict[str, float]] = {}
+    if memory:
+        tracemalloc.start()
+
+    def measure(stage: str, function: T.Callable[[], T.Any]) -> T.Any:
+        if memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function()
+        results[stage] = {"time": time.perf_counter() - start}
+        if memory:
+            results[stage]["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    try:
+        entries = measure("list_commands", get_entries)
+        groups = measure("create_compilation_groups", lambda: main.create_compilation_groups(entries))
+        project_name, instructions_count, instructions = measure("create_instructions", lambda: main.create_instructions(groups))
+        measure("emit_code", lambda: main.emit_code(project_name or "PROJECT_NAME", instructions_count, instructions))
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return len(entries), results
+
+
+def growth(previous: T.Dict[str, T.Any], current: T.Dict[str, T.Any], stage: str) -> T.Union[float, None]:
+    # Exponent k of time ~ size**k between two consecutive sizes
+    t1, t2 = previous["stages"][stage]["time"], current["stages"][stage]["time"]
+    n1, n2 = previous["entries"], current["entries"]
+    if t1 <= 0 or t2 <= 0 or n1 == n2:
+        return None
+    return math.log(t2 / t1) / math.log(n2 / n1)
+
+
+def print_results(name: str, results: T.List[T.Dict[str, T.Any]], memory: bool) -> None:
+    print(f"\n{name}")
+    print(f"{'size':>14}{'entries':>9}" + "".join(f"{stage:>27}" for stage in STAGES))
+    for i, result in enumerate(results):
+        line = f"{result['size']:>14}{result['entries']:>9}"
+        for stage in STAGES:
+            stats = result["stages"][stage]
+            cell = f"{stats['time']:.3f}s"
+            if memory:
+                cell += f" {stats['peak_memory'] / 2**20:.1f}Mi"
+            exponent = growth(results[i - 1], result, stage) if i > 0 else None
+            if exponent is not None:
+                cell += f" (x^{exponent:.2f})"
+            line += f"{cell:>27}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling of the translator on synthetic build trees")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help=f"comma separated layouts among {', '.join(LAYOUTS)}")
+    parser.add_argument("--sizes", default="10x10,20x20,40x40,80x40", help="comma separated TARGETSxSOURCES")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="jobs given to list_commands")
+    parser.add_argument("--traces", nargs="+", metavar="TRACE", help="measure recorded traces instead of synthetic projects, make is not needed")
+    parser.add_argument("--record-traces", metavar="DIR", help="save the dry run of each synthetic tree in DIR, to measure it later with --traces")
+    parser.add_argument("--keep", metavar="DIR", help="write the synthetic trees in DIR and keep them")
+    parser.add_argument("--no-memory", action="store_true", help="don't measure the peak memory, tracemalloc slows everything down")
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    args = parser.parse_args()
+    memory = not args.no_memory
+
+    report: T.Dict[str, T.List[T.Dict[str, T.Any]]] = {}
+    if args.traces is not None:
+        # The traces recorded by --record-traces are named LAYOUT-SIZE.trace.gz, each layout is a series
+        series: T.Dict[str, T.List[T.Dict[str, T.Any]]] = {}
+        for trace in args.traces:
+            name = os.path.basename(trace).split(".trace")[0]
+            count, stages = run_stages(lambda: dry_run_trace.load_trace(trace), memory)
+            series.setdefault(name.rsplit('-', 1)[0], []).append({"size": name.rsplit('-', 1)[-1], "trace": trace, "entries": count, "stages": stages})
+        for name, results in series.items():
+            results.sort(key=lambda result: result["entries"])
+            report[name] = results
+            print_results(f"{name} (list_commands is the loading of the trace)", results, memory)
+    else:
+        use_fake_toolchain()
+        layouts = args.layouts.split(',')
+        if shutil.which("make") is None and any(layout != "entries" for layout in layouts):
+            print("make not found, only the entries layout is measured")
+            layouts = [layout for layout in layouts if layout == "entries"]
+        workdir = args.keep if args.keep is not None else tempfile.mkdtemp(prefix="makefile_to_powermake_bench_")
+        if args.record_traces is not None:
+            os.makedirs(args.record_traces, exist_ok=True)
+        try:
+            for layout in layouts:
+                results = []
+                for size in args.sizes.split(','):
+                    targets, sources = parse_size(size)
+                    if layout == "entries":
+                        get_entries: T.Callable[[], T.Sequence[T.Tuple[str, str]]] = lambda: synthetic_entries(targets, sources)
+                    else:
+                        folder = write_tree(layout, os.path.join(workdir, f"{layout}-{targets}x{sources}"), targets, sources)
+                        get_entries = lambda: makefile_dry_run.list_commands(["make"], folder, args.jobs)
+                        if args.record_traces is not None:
+                            dry_run_trace.save_trace(os.path.join(args.record_traces, f"{layout}-{targets}x{sources}.trace.gz"), get_entries())
+                    count, stages = run_stages(get_entries, memory)
+                    results.append({"size": f"{targets}x{sources}", "entries": count, "stages": stages})
+                report[layout] = results
+                print_results(layout, results, memory)
+        finally:
+            if args.keep is None:
+                shutil.rmtree(workdir)
+
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
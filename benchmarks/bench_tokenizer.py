@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import shlex
+import argparse
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dry_run_trace
+from shell_tokenizer import tokenize, parse_command
+
+# Compare the single pass tokenizer with the way the translator used to parse each command:
+# a character by character walk to find `&&`, then shlex.split once in split_commands_by_cwd,
+# once in neutralize_make, twice in the ranlib/ar merge and once in create_compilation_groups.
+
+
+def legacy_consume_command(command: str, i: int, stop_at_space: bool = False) -> int:
+    in_string = 0
+    escaped = False
+    while i+1 < len(command) and (in_string or escaped or ((command[i] != '&' or command[i+1] != '&') and (not stop_at_space or command[i] != ' ' and command[i] != '\t'))):
+        if not escaped and command[i] == '"' and in_string != 2:
+            if in_string == 0:
+                in_string = 1
+            else:
+                in_string = 0
+        elif not escaped and command[i] == "'" and in_string != 1:
+            if in_string == 0:
+                in_string = 2
+            else:
+                in_string = 0
+
+        if command[i] == '\\':
+            escaped = True
+        else:
+            escaped = False
+
+        i += 1
+
+    if i+1 == len(command):
+        i += 1
+    return i
+
+
+def legacy_parse(line: str) -> int:
+    words = 0
+    i = 0
+    while i < len(line):
+        s = i
+        i = legacy_consume_command(line, i)
+        parsed_command = shlex.split(line[s: i])  # split_commands_by_cwd
+        if len(parsed_command) > 0 and parsed_command[0] != "cd":
+            cmd = line[s: i]
+            shlex.split(cmd)  # neutralize_make
+            legacy_consume_command(cmd, 0, True)
+            shlex.split(cmd)  # ranlib/ar merge
+            shlex.split(cmd)  # ranlib/ar merge, previous command
+            words += len(shlex.split(cmd))  # create_compilation_groups
+        while i < len(line) and line[i] == '&':
+            i += 1
+        while i < len(line) and (line[i] == ' ' or line[i] == '\t'):
+            i += 1
+    return words
+
+
+def tokenizer_parse(line: str) -> int:
+    words = 0
+    for cmd in tokenize(line):
+        if len(cmd.args) > 0 and cmd.args[0] != "cd":
+            words += len(parse_command(cmd).args)
+    return words
+
+
+def synthetic_cmake_lines(count: int) -> T.List[str]:
+    # Looks like the output of `make -n -B` on a CMake project
+    lines = []
+    for i in range(count):
+        target = f"target{i // 200}"
+        if i % 3 == 0:
+            lines.append(f'/usr/bin/cmake -E cmake_echo_color --switch= --green --progress-dir=/src/build/CMakeFiles --progress-num={i} "Building C object CMakeFiles/{target}.dir/src/file{i}.c.o"')
+        elif i % 3 == 1:
+            lines.append(f'cd /src/build/{target} && /usr/bin/cc -DOPENSSL_NO_ASM -D_XOPEN_SOURCE=700 -DVERSION=\\"1.{i}\\" -I/src/include -I/src/build/{target} -Wall -Werror -Wformat=2 -Wsign-compare -fPIC -std=c11 -MD -MT CMakeFiles/{target}.dir/src/file{i}.c.o -MF CMakeFiles/{target}.dir/src/file{i}.c.o.d -o CMakeFiles/{target}.dir/src/file{i}.c.o -c \'/src/{target}/file {i}.c\'')
+        else:
+            lines.append(f"make -s -f CMakeFiles/{target}.dir/build.make CMakeFiles/{target}.dir/depend")
+    return lines
+
+
+def bench(function: T.Callable[[str], int], lines: T.List[str], repeat: int) -> T.Tuple[float, int]:
+    best = float("inf")
+    words = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        words = 0
+        for line in lines:
+            words += function(line)
+        best = min(best, time.perf_counter() - start)
+    return best, words
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the command tokenizer")
+    parser.add_argument("--trace", help="use the commands of a trace recorded with `main.py --record-trace` instead of synthetic ones")
+    parser.add_argument("--lines", type=int, default=13000, help="number of synthetic lines (default: 13000, about the size of BoringSSL)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        lines = [str(command) for _, command in dry_run_trace.load_trace(args.trace)]
+    else:
+        lines = synthetic_cmake_lines(args.lines)
+
+    legacy_time, legacy_words = bench(legacy_parse, lines, args.repeat)
+    tokenizer_time, tokenizer_words = bench(tokenizer_parse, lines, args.repeat)
+    if legacy_words != tokenizer_words:
+        print(f"warning: the tokenizer found {tokenizer_words} words, the legacy path {legacy_words}")
+
+    print(f"{len(lines)} lines")
+    print(f"legacy (consume_command + 5 x shlex.split): {legacy_time * 1000:8.1f} ms")
+    print(f"single pass tokenizer:                     {tokenizer_time * 1000:8.1f} ms")
+    print(f"speedup: x{legacy_time / tokenizer_time:.1f}")
@@ -0,0 +1,73 @@
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import toolchain
+import dry_run_trace
+from shell_tokenizer import parse_command
+from synthetic import synthetic_entries
+
+# Translate the same traces in memory and with --max-memory, each in a new process, and check that the generated
+# PowerMakes are the same. The synthetic trace is built with a cross toolchain that isn't installed here,
+# its binaries are only known from the trace: the commands must still be translated, not run with run_command.
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+CROSS_TOOLCHAIN: T.Dict[str, T.Union[str, None]] = {"xcc": "/opt/cross/bin/arm-none-eabi-gcc", "xc++": "/opt/cross/bin/arm-none-eabi-g++", "xar": "/opt/cross/bin/arm-none-eabi-ar"}
+CROSS_NAMES = {"/usr/bin/cc": "xcc", "/usr/bin/c++": "xc++", "/usr/bin/ar": "xar"}
+
+
+def write_cross_trace(path: str, targets: int, sources: int) -> None:
+    entries = []
+    for cwd, command in synthetic_entries(targets, sources):
+        binary, rest = command.split(' ', 1)
+        entries.append((cwd, parse_command(f"{CROSS_NAMES[binary]} {rest}")))
+    toolchain.seed(CROSS_TOOLCHAIN)
+    dry_run_trace.save_trace(path, entries)
+
+
+def translate(trace: str, directory: str, options: T.List[str]) -> str:
+    # The output depends on the order of the sets, it's fixed by PYTHONHASHSEED
+    os.makedirs(directory)
+    subprocess.run([sys.executable, MAIN, *options, trace], cwd=directory, env={**os.environ, "PYTHONHASHSEED": "0"}, stdout=subprocess.DEVNULL, check=True)
+    with open(os.path.join(directory, "generated.py"), "r") as file:
+        return file.read()
+
+
+def check(trace: str, directory: str, max_memory: int, cross: bool) -> T.List[str]:
+    problems = []
+    for i, options in enumerate([[], ["--parallel-stages"]]):
+        in_memory = translate(trace, os.path.join(directory, f"memory{i}"), options)
+        spilled = translate(trace, os.path.join(directory, f"spilled{i}"), [*options, "--max-memory", str(max_memory)])
+        mode = " ".join(options) or "default"
+        if in_memory != spilled:
+            problems.append(f"{mode}: the generated PowerMakes are different")
+        for name, code in (("in memory", in_memory), ("spilled", spilled)):
+            if cross and "powermake.run_command(" in code:
+                problems.append(f"{mode}, {name}: commands of the cross toolchain translated to run_command")
+            if 'powermake.run("PROJECT_NAME"' in code:
+                problems.append(f"{mode}, {name}: the project name wasn't found")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that --max-memory generates the same PowerMake as the translation in memory")
+    parser.add_argument("--synthetic", metavar="TARGETSxSOURCES", default="20x10", help="size of the synthetic cross toolchain trace")
+    parser.add_argument("--traces", nargs="*", default=[], metavar="TRACE", help="recorded traces to check too")
+    parser.add_argument("--max-memory", type=int, default=16, metavar="MIB", help="--max-memory given to the translation")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="makefile_to_powermake_spill_") as directory:
+        targets, sources = (int(n) for n in args.synthetic.lower().split('x'))
+        cross_trace = os.path.join(directory, "cross.trace.gz")
+        write_cross_trace(cross_trace, targets, sources)
+        for i, trace in enumerate([cross_trace, *args.traces]):
+            problems = check(trace, os.path.join(directory, str(i)), args.max_memory, trace == cross_trace)
+            print(f"{'synthetic cross toolchain' if trace == cross_trace else trace}: {'ok' if len(problems) == 0 else ', '.join(problems)}")
+            failed = failed or len(problems) > 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,160 @@
+import os
+import sys
+import typing as T
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import toolchain
+from shell_tokenizer import Command, parse_command
+
+# Synthetic (cwd, command) entries that look like the output of list_commands on a CMake project:
+# `targets` libraries of `sources` files each, with a few different sets of flags,
+# every third library is shared, the others are static, and an executable links all of them.
+# The same projects can also be written on disk as real build trees, a plain GNU Makefile or a CMake-like
+# recursive layout, to dry run them with make. They only use C so they can be built with a C compiler alone.
+
+LAYOUTS = ["entries", "make", "cmake"]
+
+
+def use_fake_toolchain() -> None:
+    # The entries are classified without a compiler installed
+    toolchain.seed({"cc": "/usr/bin/cc", "c++": "/usr/bin/c++", "ar": "/usr/bin/ar", "ranlib": "/usr/bin/ranlib", "cmake": "/usr/bin/cmake"})
+
+
+def synthetic_entries(targets: int, sources: int, root: str = "/synthetic") -> T.List[T.Tuple[str, Command]]:
+    use_fake_toolchain()
+    build = os.path.join(root, "build")
+    entries: T.List[T.Tuple[str, Command]] = []
+    libraries = []
+    for t in range(targets):
+        target = f"lib{t}"
+        shared = t % 3 == 2
+        objects = []
+        for s in range(sources):
+            compiler = "c++" if s % 5 == 4 else "cc"
+            extension = "cpp" if compiler == "c++" else "c"
+            flags = f"-DTARGET_{t} -DFLAVOR_{s % 3} -I{root}/include -I{root}/{target}/include -Wall -O2"
+            if shared:
+                flags += " -fPIC"
+            source = f"{root}/{target}/src/file{s}.{extension}"
+            obj = f"CMakeFiles/{target}.dir/src/file{s}.{extension}.o"
+            objects.append(obj)
+            entries.append((build, parse_command(f"/usr/bin/{compiler} {flags} -MD -MT {obj} -MF {obj}.d -o {obj} -c {source}")))
+        if shared:
+            output = f"{target}.so"
+            entries.append((build, parse_command(f"/usr/bin/c++ -fPIC -shared -Wl,-soname,{output} -o {output} {' '.join(objects)}")))
+        else:
+            output = f"{target}.a"
+            entries.append((build, parse_command(f"/usr/bin/ar -s qc {output} {' '.join(objects)}")))
+        libraries.append(output)
+
+    main_obj = "CMakeFiles/app.dir/main.c.o"
+    entries.append((build, parse_command(f"/usr/bin/cc -I{root}/include -o {main_obj} -c {root}/app/main.c")))
+    entries.append((build, parse_command(f"/usr/bin/cc {main_obj} -o app {' '.join(libraries)}")))
+    return entries
+
+
+def _write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def _write_sources(root: str, targets: int, sources: int) -> None:
+    for t in range(targets):
+        for s in range(sources):
+            _write(os.path.join(root, f"lib{t}", "src", f"file{s}.c"), f"int lib{t}_file{s}(void) {{ return {s}; }}\n")
+    calls = " + ".join(f"lib{t}_file0()" for t in range(targets)) or "0"
+    declarations = "".join(f"int lib{t}_file0(void);\n" for t in range(targets))
+    _write(os.path.join(root, "app", "main.c"), f"{declarations}int main(void) {{ return {calls}; }}\n")
+    _write(os.path.join(root, "include", "synthetic.h"), "#define SYNTHETIC 1\n")
+
+
+def _target_flags(root: str, t: int, s: int) -> str:
+    flags = f"-DTARGET_{t} -DFLAVOR_{s % 3} -I{root}/include -I{root}/lib{t}/include -Wall -O2"
+    if t % 3 == 2:
+        flags += " -fPIC"
+    return flags
+
+
+def write_make_tree(root: str, targets: int, sources: int) -> str:
+    # A single GNU Makefile with explicit rules, like a hand written one. Returns the folder to translate.
+    root = os.path.abspath(root)
+    _write_sources(root, targets, sources)
+    rules = []
+    libraries = []
+    for t in range(targets):
+        objects = []
+        for s in range(sources):
+            # The flavor changes the flags of some files in each target, they can't all be compiled together
+            obj = f"lib{t}/src/file{s}.o"
+            objects.append(obj)
+            rules.append(f"{obj}: lib{t}/src/file{s}.c\n\t$(CC) {_target_flags('.', t, s)} -c lib{t}/src/file{s}.c -o {obj}\n")
+        if t % 3 == 2:
+            output = f"liblib{t}.so"
+            rules.append(f"{output}: {' '.join(objects)}\n\t$(CC) -shared -o {output} {' '.join(objects)}\n")
+        else:
+            output = f"liblib{t}.a"
+            rules.append(f"{output}: {' '.join(objects)}\n\t$(AR) qc {output} {' '.join(objects)}\n\tranlib {output}\n")
+        libraries.append(output)
+    rules.append("app/main.o: app/main.c\n\t$(CC) -Iinclude -c app/main.c -o app/main.o\n")
+    rules.append(f"app/app: app/main.o {' '.join(libraries)}\n\t$(CC) app/main.o -o app/app -L. {' '.join(libraries)}\n")
+    _write(os.path.join(root, "Makefile"), "CC = cc\nAR = ar\n\nall: app/app\n\n" + "\n".join(rules))
+    return root
+
+
+def write_cmake_tree(root: str, targets: int, sources: int) -> str:
+    # Recursive Makefiles laid out like the ones generated by CMake: build/Makefile calls CMakeFiles/Makefile2,
+    # which calls the build.make of each target, the links are in link.txt scripts. Returns the build folder.
+    root = os.path.abspath(root)
+    _write_sources(root, targets, sources)
+    build = os.path.join(root, "build")
+    header = "SHELL = /bin/sh\nCMAKE_COMMAND = cmake\n\n"
+    _write(os.path.join(build, "Makefile"), header + "all:\n\t$(MAKE) -s -f CMakeFiles/Makefile2 all\n.PHONY : all\n")
+
+    makefile2 = [header]
+    libraries: T.List[str] = []
+    for t in range(targets + 1):
+        name = f"lib{t}" if t < targets else "app"
+        target_dir = f"CMakeFiles/{name}.dir"
+        if t < targets:
+            files = [(f"{root}/lib{t}/src/file{s}.c", f"{target_dir}/src/file{s}.c.o", s) for s in range(sources)]
+        else:
+            files = [(f"{root}/app/main.c", f"{target_dir}/main.c.o", 0)]
+        flags = {flavor: _target_flags(root, t, flavor) for flavor in range(3)} if t < targets else {0: f"-I{root}/include"}
+        objects = [obj for _, obj, _ in files]
+
+        build_make = [header, f"include {target_dir}/flags.make\n\n"]
+        for source, obj, s in files:
+            build_make.append(f"{obj}: {target_dir}/flags.make\n{obj}: {source}\n\tcc $(C_FLAGS_{s % 3}) -o {obj} -c {source}\n\n")
+        if t == targets:
+            output = "app"
+            link = f"cc {' '.join(objects)} -o app {' '.join(libraries)}\n"
+        elif t % 3 == 2:
+            output = f"liblib{t}.so"
+            link = f"cc -fPIC -shared -Wl,-soname,{output} -o {output} {' '.join(objects)}\n"
+        else:
+            output = f"liblib{t}.a"
+            link = f"ar qc {output} {' '.join(objects)}\nranlib {output}\n"
+        build_make.append(f"{output}: {' '.join(objects)}\n{output}: {target_dir}/build.make\n\t$(CMAKE_COMMAND) -E cmake_link_script {target_dir}/link.txt --verbose=$(VERBOSE)\n\n")
+        build_make.append(f"{target_dir}/build: {output}\n.PHONY : {target_dir}/build\n\n")
+        build_make.append(f"{target_dir}/depend:\n\t$(CMAKE_COMMAND) -E cmake_depends \"Unix Makefiles\" {root} {root} {build} {build} {build}/{target_dir}/DependInfo.cmake\n.PHONY : {target_dir}/depend\n")
+        _write(os.path.join(build, target_dir, "build.make"), "".join(build_make))
+        _write(os.path.join(build, target_dir, "flags.make"), "".join(f"C_FLAGS_{flavor} = {value}\n" for flavor, value in flags.items()))
+        _write(os.path.join(build, target_dir, "link.txt"), link)
+
+        dependencies = "".join(f" CMakeFiles/lib{d}.dir/all" for d in range(targets)) if t == targets else ""
+        makefile2.append(f"all: {target_dir}/all\n{target_dir}/all:{dependencies}\n")
+        makefile2.append(f"\t$(MAKE) -s -f {target_dir}/build.make {target_dir}/depend\n")
+        makefile2.append(f"\t$(MAKE) -s -f {target_dir}/build.make {target_dir}/build\n.PHONY : {target_dir}/all\n\n")
+        libraries.append(output)
+    _write(os.path.join(build, "CMakeFiles", "Makefile2"), "".join(makefile2))
+    return build
+
+
+def write_tree(layout: str, root: str, targets: int, sources: int) -> str:
+    if layout == "make":
+        return write_make_tree(root, targets, sources)
+    if layout == "cmake":
+        return write_cmake_tree(root, targets, sources)
+    raise ValueError(f"no build tree for the layout {layout}")
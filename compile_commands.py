@@ -0,0 +1,181 @@
+import os
+import json
+import glob
+import shlex
+import typing as T
+
+import toolchain
+import makefile_dry_run
+from shell_tokenizer import Command, parse_command
+
+# Front end for CMake projects configured with CMAKE_EXPORT_COMPILE_COMMANDS.
+# compile_commands.json already contains every compile line, so there is no need to dry run make to find them.
+# The only missing steps are the links and the archives, they are read from the
+# CMakeFiles/<target>.dir/link.txt scripts that make would execute anyway.
+
+
+def _iter_json_array(file: T.TextIO, chunk_size: int = 1 << 16) -> T.Iterator[T.Any]:
+    # Yield the elements of a top level JSON array without loading the whole document
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        i = 0
+        while i < len(buffer) and (buffer[i].isspace() or buffer[i] == ',' or (not started and buffer[i] == '[')):
+            if buffer[i] == '[':
+                started = True
+            i += 1
+        buffer = buffer[i:]
+        if started and buffer.startswith(']'):
+            return
+        if len(buffer) > 0 and started:
+            try:
+                element, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield element
+                buffer = buffer[end:]
+                continue
+        elif len(buffer) > 0:
+            raise ValueError("compile_commands.json must contain a JSON array")
+        if eof:
+            if not started:
+                raise ValueError("compile_commands.json must contain a JSON array")
+            raise ValueError("compile_commands.json: unexpected end of file")
+        chunk = file.read(chunk_size)
+        if len(chunk) == 0:
+            eof = True
+        buffer += chunk
+
+
+def iter_compile_commands(path: str) -> T.Iterator[T.Tuple[str, Command, T.List[str]]]:
+    with open(path, "r", encoding="utf-8") as file:
+        for element in _iter_json_array(file):
+            directory = element.get("directory", os.path.dirname(os.path.abspath(path)))
+            if "arguments" in element:
+                arguments = element["arguments"]
+                command = Command(shlex.join(arguments), arguments, len(shlex.quote(arguments[0])) if len(arguments) > 0 else 0)
+            else:
+                command = parse_command(element["command"])
+                arguments = command.args
+            if "output" in element:
+                arguments = [*arguments, "-o", element["output"]]
+            yield directory, command, arguments
+
+
+def get_output(arguments: T.List[str], cwd: str) -> T.Union[str, None]:
+    output = None
+    i = 1
+    while i < len(arguments):
+        if arguments[i] == "-o" and i + 1 < len(arguments):
+            output = arguments[i + 1]
+            i += 1
+        elif arguments[i].startswith("-o"):
+            output = arguments[i][2:]
+        i += 1
+    if output is None:
+        return None
+    return os.path.normpath(os.path.join(cwd, output))
+
+
+def get_target_dir(output: T.Union[str, None]) -> T.Union[str, None]:
+    # CMake puts the objects of a target in <binary dir>/CMakeFiles/<target>.dir/
+    if output is None:
+        return None
+    i = output.rfind(".dir" + os.sep)
+    if i == -1 or os.sep + "CMakeFiles" + os.sep not in output[:i]:
+        return None
+    return output[:i + 4]
+
+
+def read_link_script(target_dir: str) -> T.List[T.Tuple[str, Command]]:
+    link_script = os.path.join(target_dir, "link.txt")
+    if not os.path.isfile(link_script):
+        return []
+    file = open(link_script, "r")
+    cmds = file.read().split('\n')
+    file.close()
+    for i in range(len(cmds)):
+        cmds[i] = cmds[i].strip()
+    # link.txt is executed from the binary dir that contains CMakeFiles/
+    cwd = os.path.dirname(os.path.dirname(target_dir))
+    return makefile_dry_run.list_commands(cmds, cwd)
+
+
+def get_link_output(command: str, cwd: str) -> T.Union[str, None]:
+    splitted = parse_command(command).args
+    if len(splitted) == 0:
+        return None
+    if toolchain.binary_kind(splitted[0]) == "archiver":
+        for el in splitted[1:]:
+            if el.endswith(".a"):
+                return os.path.normpath(os.path.join(cwd, el))
+        return None
+    return get_output(splitted, cwd)
+
+
+def list_commands(compile_commands_path: str, build_folder: T.Union[str, None] = None) -> T.List[T.Tuple[str, Command]]:
+    if build_folder is None:
+        build_folder = os.path.dirname(os.path.abspath(compile_commands_path))
+
+    # Targets are kept in the order of their first compile command
+    targets_compile: T.Dict[T.Union[str, None], T.List[T.Tuple[str, Command]]] = {None: []}
+    for directory, command, arguments in iter_compile_commands(compile_commands_path):
+        target_dir = get_target_dir(get_output(arguments, directory))
+        if target_dir not in targets_compile:
+            targets_compile[target_dir] = []
+        targets_compile[target_dir].append((directory, command))
+
+    for link_script in sorted(glob.glob(os.path.join(glob.escape(build_folder), "**", "CMakeFiles", "*.dir", "link.txt"), recursive=True)):
+        target_dir = os.path.normpath(os.path.dirname(link_script))
+        if target_dir not in targets_compile:
+            targets_compile[target_dir] = []
+
+    targets_link: T.Dict[T.Union[str, None], T.List[T.Tuple[str, Command]]] = {None: []}
+    producers: T.Dict[str, T.Union[str, None]] = {}
+    for target_dir in targets_compile:
+        if target_dir is None:
+            continue
+        targets_link[target_dir] = read_link_script(target_dir)
+        for cwd, command in targets_link[target_dir]:
+            output = get_link_output(command, cwd)
+            if output is not None:
+                producers[output] = target_dir
+
+    # A target must come after the libraries it links with
+    targets_deps: T.Dict[T.Union[str, None], T.Set[T.Union[str, None]]] = {}
+    for target_dir in targets_compile:
+        targets_deps[target_dir] = set()
+        for cwd, command in targets_link[target_dir]:
+            for el in parse_command(command).args[1:]:
+                producer = producers.get(os.path.normpath(os.path.join(cwd, el)))
+                if producer is not None and producer != target_dir:
+                    targets_deps[target_dir].add(producer)
+
+    targets_index = {target_dir: i for i, target_dir in enumerate(targets_compile)}
+    ordered: T.List[T.Union[str, None]] = []
+    visited: T.Set[T.Union[str, None]] = set()
+
+    def visit(target_dir: T.Union[str, None], stack: T.Set[T.Union[str, None]]) -> None:
+        if target_dir in visited:
+            return
+        if target_dir in stack:
+            raise RuntimeError(f"Dependency cycle between the link steps of {target_dir}")
+        stack.add(target_dir)
+        for dep in sorted(targets_deps[target_dir], key=targets_index.__getitem__):
+            visit(dep, stack)
+        stack.remove(target_dir)
+        visited.add(target_dir)
+        ordered.append(target_dir)
+
+    for target_dir in targets_compile:
+        visit(target_dir, set())
+
+    entries: T.List[T.Tuple[str, Command]] = []
+    for target_dir in ordered:
+        entries.extend(targets_compile[target_dir])
+        entries.extend(targets_link[target_dir])
+    return entries
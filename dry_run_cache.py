@@ -0,0 +1,167 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import typing as T
+
+from shell_tokenizer import Command, parse_command
+
+# On-disk cache of the sub-make expansions, used to translate again a big project after a small change.
+# Each expansion is stored with the hash of every Makefile it depends on: the Makefiles read by make
+# (with their includes), the ones of the nested sub-makes and the cmake link scripts.
+# An expansion is only replayed if none of these files changed, and if make sees the same environment:
+# every environment variable is a variable of make (CC, CFLAGS, PREFIX...), even for the Makefiles that don't mention it.
+
+CACHE_VERSION = 2
+
+_INCLUDE_RE = re.compile(r"^[ \t]*(?:-|s)?include[ \t]+(.*)$", re.MULTILINE)
+_DYNAMIC_RE = re.compile(r"\$[({](?:wildcard|shell)[ \t]")
+
+# Changed by the shell at every command, they don't change what make prints
+_VOLATILE_ENVIRONMENT = {"_", "OLDPWD", "PWD", "SHLVL"}
+
+# The hashes of the files involved, None if the expansion can't be cached
+Closure = T.Union[T.Dict[str, T.Union[str, None]], None]
+
+
+def file_hash(path: str) -> T.Union[str, None]:
+    try:
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def makefiles_of(neutralized_command: str, cwd: str) -> T.Union[T.List[str], None]:
+    # The Makefiles read by a `make -n -B ...` command, None if they can't be known for sure
+    args = parse_command(neutralized_command).args
+    makefiles: T.List[str] = []
+    include_dirs: T.List[str] = []
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        value = None
+        if arg in ("-f", "--file", "--makefile", "-C", "--directory", "-I", "--include-dir") and i + 1 < len(args):
+            i += 1
+            value = args[i]
+        elif arg.startswith(("--file=", "--makefile=", "--directory=", "--include-dir=")):
+            arg, value = arg.split('=', 1)
+        elif arg.startswith(("-f", "-C", "-I")) and len(arg) > 2:
+            arg, value = arg[:2], arg[2:]
+
+        if value is None:
+            pass
+        elif arg in ("-f", "--file", "--makefile"):
+            makefiles.append(value)
+        elif arg in ("-C", "--directory"):
+            cwd = os.path.join(cwd, value)
+        else:
+            include_dirs.append(value)
+        i += 1
+
+    makefiles = [os.path.join(cwd, makefile) for makefile in makefiles]
+    if len(makefiles) == 0:
+        for name in ("GNUmakefile", "makefile", "Makefile"):
+            if os.path.isfile(os.path.join(cwd, name)):
+                makefiles.append(os.path.join(cwd, name))
+                break
+    for makefile in os.environ.get("MAKEFILES", "").split():
+        makefiles.append(os.path.join(cwd, makefile))
+
+    # Follow the include directives
+    i = 0
+    while i < len(makefiles):
+        try:
+            with open(makefiles[i], "r", errors="replace") as file:
+                content = file.read()
+        except OSError:
+            i += 1
+            continue
+        if _DYNAMIC_RE.search(content) is not None:
+            return None  # the output also depends on the files found or on the commands run by make
+        for match in _INCLUDE_RE.finditer(content.replace("\\\n", " ")):
+            for included in match.group(1).split('#', 1)[0].split():
+                if '$' in included or '*' in included or '?' in included:
+                    return None  # depends on the variables of make, we can't know the file
+                candidates = [os.path.join(cwd, included)] + [os.path.join(cwd, dir, included) for dir in include_dirs]
+                path = next((candidate for candidate in candidates if os.path.isfile(candidate)), candidates[0])
+                if path not in makefiles:
+                    makefiles.append(path)
+        i += 1
+    return makefiles
+
+
+class DryRunCache:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._hashes: T.Dict[str, T.Union[str, None]] = {}
+        self._environment = sorted((name, value) for name, value in os.environ.items() if name not in _VOLATILE_ENVIRONMENT)
+        os.makedirs(directory, exist_ok=True)
+
+    def file_hash(self, path: str) -> T.Union[str, None]:
+        # The files don't change during a run, each one is only hashed once
+        path = os.path.realpath(path)
+        if path not in self._hashes:
+            self._hashes[path] = file_hash(path)
+        return self._hashes[path]
+
+    def hashes(self, paths: T.Iterable[str]) -> T.Dict[str, T.Union[str, None]]:
+        return {os.path.realpath(path): self.file_hash(path) for path in paths}
+
+    def _base_path(self, key: T.Tuple[str, ...]) -> str:
+        digest = hashlib.sha256(json.dumps([CACHE_VERSION, *key, self._environment]).encode()).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def load(self, key: T.Tuple[str, ...]) -> T.Union[T.Tuple[T.Dict[str, T.Union[str, None]], T.Iterator[T.Tuple[str, Command]]], None]:
+        base_path = self._base_path(key)
+        try:
+            with open(base_path + ".json", "r", encoding="utf-8") as file:
+                files = json.load(file)["files"]
+        except (OSError, ValueError, KeyError):
+            return None
+        for path, digest in files.items():
+            if self.file_hash(path) != digest:
+                return None
+        if not os.path.isfile(base_path + ".entries.gz"):
+            return None
+        return files, self._read_entries(base_path + ".entries.gz")
+
+    def _read_entries(self, path: str) -> T.Iterator[T.Tuple[str, Command]]:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            cwd = "."
+            for line in file:
+                record = json.loads(line)
+                if len(record) == 2:
+                    cwd = record[0]
+                yield cwd, parse_command(record[-1])
+
+    def writer(self, key: T.Tuple[str, ...]) -> "DryRunCacheWriter":
+        return DryRunCacheWriter(self._base_path(key))
+
+
+class DryRunCacheWriter:
+    # The entries are written while they are produced, the expansion is only visible in the cache once committed
+    def __init__(self, base_path: str) -> None:
+        self.base_path = base_path
+        self.tmp_suffix = f".{os.getpid()}.tmp"
+        self.file = gzip.open(base_path + ".entries.gz" + self.tmp_suffix, "wt", encoding="utf-8")
+        self.last_cwd: T.Union[str, None] = None
+
+    def write(self, cwd: str, command: str) -> None:
+        if cwd == self.last_cwd:
+            self.file.write(json.dumps([command]) + "\n")
+        else:
+            self.file.write(json.dumps([cwd, command]) + "\n")
+            self.last_cwd = cwd
+
+    def commit(self, files: T.Dict[str, T.Union[str, None]]) -> None:
+        self.file.close()
+        os.replace(self.base_path + ".entries.gz" + self.tmp_suffix, self.base_path + ".entries.gz")
+        with open(self.base_path + ".json" + self.tmp_suffix, "w", encoding="utf-8") as file:
+            json.dump({"files": files}, file)
+        os.replace(self.base_path + ".json" + self.tmp_suffix, self.base_path + ".json")
+
+    def abort(self) -> None:
+        self.file.close()
+        os.remove(self.base_path + ".entries.gz" + self.tmp_suffix)
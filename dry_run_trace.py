@@ -0,0 +1,102 @@
+import os
+import gzip
+import json
+import typing as T
+
+import toolchain
+from shell_tokenizer import Command, parse_command
+
+# A trace is the flat (cwd, command) list returned by makefile_dry_run.list_commands.
+# It's stored as JSON lines, the first line is a header,
+# each following line is either [cwd, command] or [command] when the cwd didn't change.
+# The file is gzip compressed if its name ends with `.gz`.
+# The last line keeps where each binary was found when the trace was recorded (they are found while make runs),
+# so a trace can be translated on a machine without make or the toolchain. It's read before the commands.
+
+TRACE_FORMAT = "makefile_to_powermake_trace"
+TRACE_VERSION = 1
+
+
+def _open_trace(path: str, mode: str) -> T.TextIO:
+    if path.endswith(".gz"):
+        return T.cast(T.TextIO, gzip.open(path, mode + "t", encoding="utf-8"))
+    return T.cast(T.TextIO, open(path, mode, encoding="utf-8"))
+
+
+def is_trace_file(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    try:
+        with _open_trace(path, "r") as file:
+            header = json.loads(file.readline())
+    except (OSError, ValueError, UnicodeDecodeError):
+        return False
+    return isinstance(header, dict) and header.get("format") == TRACE_FORMAT
+
+
+def record_trace(path: str, entries: T.Iterable[T.Tuple[str, str]]) -> T.Iterator[T.Tuple[str, str]]:
+    # Write the entries in the trace while they are passed through, so they can be recorded while make is running
+    which: T.Dict[str, T.Union[str, None]] = {}
+    for name in ("make", "cmake", "mkdir", "echo", "printf"):
+        which[name] = toolchain.sh_which_cache(name)
+    with _open_trace(path, "w") as file:
+        file.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION}) + "\n")
+        last_cwd = None
+        for cwd, command in entries:
+            if cwd == last_cwd:
+                file.write(json.dumps([command]) + "\n")
+            else:
+                file.write(json.dumps([cwd, command]) + "\n")
+                last_cwd = cwd
+            try:
+                splitted = parse_command(command).args
+            except ValueError:
+                splitted = []
+            if len(splitted) > 0 and splitted[0] not in which:
+                which[splitted[0]] = toolchain.sh_which_cache(splitted[0])
+            # The compiler run by a launcher (ccache gcc ...) is needed to translate the command too
+            if len(splitted) > 1 and splitted[1] not in which and toolchain.binary_kind(splitted[0]) == "launcher":
+                which[splitted[1]] = toolchain.sh_which_cache(splitted[1])
+            yield cwd, command
+        file.write(json.dumps({"which": which}) + "\n")
+
+
+def save_trace(path: str, entries: T.Iterable[T.Tuple[str, str]]) -> None:
+    for _ in record_trace(path, entries):
+        pass
+
+
+def load_trace(path: str) -> T.List[T.Tuple[str, Command]]:
+    return list(iter_trace(path))
+
+
+def _read_which(file: T.TextIO) -> T.Dict[str, T.Union[str, None]]:
+    # Only the records that are objects are parsed, the commands are arrays
+    which: T.Dict[str, T.Union[str, None]] = {}
+    for line in file:
+        if line.startswith('{'):
+            which.update(json.loads(line).get("which", {}))
+    return which
+
+
+def iter_trace(path: str) -> T.Iterator[T.Tuple[str, Command]]:
+    with _open_trace(path, "r") as file:
+        header = json.loads(file.readline())
+        if not isinstance(header, dict) or header.get("format") != TRACE_FORMAT:
+            raise ValueError(f"{path} is not a dry run trace")
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path}: unsupported trace version {header.get('version')}")
+        # The commands can be classified as soon as they are read (--max-memory), the toolchain must be known before
+        toolchain.seed(_read_which(file))
+    with _open_trace(path, "r") as file:
+        file.readline()
+        cwd = "."
+        for line in file:
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                continue
+            if len(record) == 2:
+                cwd = record[0]
+            yield cwd, parse_command(record[-1])
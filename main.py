@@ -1,38 +1,56 @@
 import os
-import sys
+import argparse
 import json
-import glob
-import shlex
+import fnmatch
+import io
+import time
+import shutil
+import tempfile
+import cProfile
+import contextlib
+import concurrent.futures
 import typing as T
 
+import toolchain
+import profiling
 import makefile_dry_run
+from shell_tokenizer import parse_command
+from records import ToolCommand, ShellCommand, Group, GroupFile
+import dry_run_trace
+import compile_commands
+from dry_run_cache import DryRunCache
+from make_database import DEFAULT_TIME_BUDGET, MakeDatabaseEngine, MakeDatabaseError
+from spill_store import SpillStore, SpilledObjectsVariables, SpilledWarnings
+from schedule import iter_stages, make_steps, powermake_steps, schedule_commands
 
 
 def is_compiler(binary: str) -> bool:
-    binary_fullpath = makefile_dry_run.sh_which_cache(binary)
-    if binary_fullpath is None:
-        return False
-    return binary_fullpath.endswith((
-        "-gcc",
-        "/gcc",
-        "-g++",
-        "/g++",
-        "-clang",
-        "/clang",
-        "-clang++",
-        "/clang++",
-        "-cc",
-        "/cc",
-        "-c++",
-        "/c++"
-    ))
+    return toolchain.binary_kind(binary) == "compiler"
+
+
+def is_launcher(binary: str) -> bool:
+    return toolchain.binary_kind(binary) == "launcher"
+
+
+def compiler_variable(compiler: str) -> str:
+    # The environment variable PowerMake reads to know the compiler
+    if compiler.endswith("++"):
+        return "CXX"
+    return "CC"
+
+
+def pch_header_language(group: Group) -> str:
+    # c-header or c++-header, from -x (added for the C++ drivers by extract_compiler_command) or from the extension of the header
+    for arg in group.args:
+        if isinstance(arg, tuple) and arg[0] == "-x" and arg[1] in ("c-header", "c++-header"):
+            return arg[1]
+    if all(dep.endswith((".c", ".h")) for dep in group.files[0].dependencies):
+        return "c-header"
+    return "c++-header"
 
 
 def is_archiver(binary: str) -> bool:
-    binary_fullpath = makefile_dry_run.sh_which_cache(binary)
-    if binary_fullpath is None:
-        return False
-    return binary_fullpath.endswith(("-ar", "/ar"))
+    return toolchain.binary_kind(binary) == "archiver"
 
 
 def is_so_version(string: str) -> bool:
@@ -44,18 +62,6 @@ def is_so_version(string: str) -> bool:
     return string[:i+1].endswith(".so")
 
 
-def all_startswith(files: T.Iterable[str], prefix: str) -> bool:
-    for file in files:
-        if not file.startswith(prefix):
-            return False
-    return True
-
-def all_endswith(files: T.Iterable[str], suffix: str) -> bool:
-    for file in files:
-        if not file.endswith(suffix):
-            return False
-    return True
-
 def one_match(files: T.Iterable[str], prefix: str, suffix: str) -> bool:
     for file in files:
         if file.startswith(prefix) and file.endswith(suffix):
@@ -63,20 +69,35 @@ def one_match(files: T.Iterable[str], prefix: str, suffix: str) -> bool:
     return False
 
 def longest_prefix(files: T.Iterable[str]) -> str:
-    base = next(iter(files))
-    i = 1
-    while i <= len(base) and all_startswith(files, base[:i]):
-        i += 1
-    return base[:i-1]
+    # The common prefix of all the strings is the common prefix of the smallest and the biggest one
+    return os.path.commonprefix(list(files))
 
 def longest_suffix(files: T.Iterable[str]) -> str:
-    base = next(iter(files))
-    i = len(base)-1
-    while i >= 0 and all_endswith(files, base[i:]):
-        i -= 1
-    return base[i+1:]
+    return os.path.commonprefix([file[::-1] for file in files])[::-1]
+
+
+_cache_listdir: T.Dict[str, T.List[str]] = {}
+def listdir_cache(dir: str) -> T.List[str]:
+    # Each directory is only listed once per run
+    if dir not in _cache_listdir:
+        try:
+            with os.scandir(dir if dir != "" else ".") as entries:
+                _cache_listdir[dir] = [entry.name for entry in entries]
+        except OSError:
+            _cache_listdir[dir] = []
+    return _cache_listdir[dir]
+
+def glob_in_dir(dir: str, pattern: str) -> T.List[str]:
+    # Same result as glob.glob(os.path.join(dir, pattern)) when `pattern` has no `/`, using the cached listing of `dir`
+    names = listdir_cache(dir)
+    if not pattern.startswith('.'):
+        names = [name for name in names if not name.startswith('.')]
+    return [os.path.join(dir, name) for name in fnmatch.filter(names, pattern)]
+
 
 def get_best_glob_match(files: T.Iterable[str]) -> T.Tuple[T.List[str], T.List[str]]:
+    if not isinstance(files, (set, frozenset)):
+        files = set(files)
     get_patterns = []
     filter_patterns = []
 
@@ -95,9 +116,10 @@ def get_best_glob_match(files: T.Iterable[str]) -> T.Tuple[T.List[str], T.List[s
         if len(files_grouped[dir]) == 1:
             get_patterns.append(next(iter(files_fullpath)))
             continue
-        pattern = os.path.join(dir, longest_prefix(files_grouped[dir]) + '*' + longest_suffix(files_grouped[dir]))
+        basename_pattern = longest_prefix(files_grouped[dir]) + '*' + longest_suffix(files_grouped[dir])
+        pattern = os.path.join(dir, basename_pattern)
         exceptions = set()
-        files_in_dir = glob.glob(pattern, recursive=True)
+        files_in_dir = glob_in_dir(dir, basename_pattern)
         for file in files_in_dir:
             if file not in files:
                 exceptions.add(file)
@@ -134,13 +156,19 @@ def flatten(l: T.List[T.Any]) -> T.List[str]:
     return o
 
 
-def extract_compiler_command(command: T.List[str], cwd: str) -> T.Tuple[T.Literal["compile", "link", "shared_link"], T.List[str], T.List[str], T.List[T.Union[str, T.Tuple[str, ...]]], T.List[str], T.Union[str, None]]:
+SOURCE_EXTENSIONS = (".c", ".cpp", ".cc", ".C", ".s", ".S", ".asm", ".rc")
+# Precompiled headers are made from a header, or from a source generated by CMake (cmake_pch.hxx.cxx)
+PCH_INPUT_EXTENSIONS = SOURCE_EXTENSIONS + (".h", ".hh", ".hpp", ".hxx", ".H", ".h++", ".cxx", ".c++")
+
+
+def extract_compiler_command(command: T.List[str], cwd: str) -> T.Tuple[T.Literal["compile", "pch", "link", "shared_link"], T.List[str], T.List[str], T.List[T.Union[str, T.Tuple[str, ...]]], T.List[str], T.Union[str, None]]:
     defines: T.List[str] = []
     includedirs: T.List[str] = []
-    remaining_args: T.List[str] = []
+    remaining_args: T.List[T.Union[str, T.Tuple[str, ...]]] = []
     inputfiles: T.List[str] = []
     outputfile: T.Union[str, None] = None
-    operation_type: T.Literal["compile", "link", "shared_link"] = "link"
+    operation_type: T.Literal["compile", "pch", "link", "shared_link"] = "link"
+    language = None  # value of -x
     i = 1
     while i < len(command):
         if command[i] == "-D":
@@ -172,6 +200,13 @@ def extract_compiler_command(command: T.List[str], cwd: str) -> T.Tuple[T.Litera
         elif command[i] == "-MF" or command[i] == "-MT" or command[i] == "-MQ":
             i += 1
 
+        elif command[i] in ("-include", "-include-pch", "-imacros", "-Xclang", "-x") and i + 1 < len(command):
+            # Their value is never an input file
+            if command[i] == "-x":
+                language = command[i+1]
+            remaining_args.append((command[i], command[i+1]))
+            i += 1
+
         elif command[i].startswith("-"):
             if command[i] == '-c':
                 operation_type = "compile"
@@ -184,13 +219,19 @@ def extract_compiler_command(command: T.List[str], cwd: str) -> T.Tuple[T.Litera
 
         i += 1
 
+    if (outputfile is not None and outputfile.endswith((".gch", ".pch"))) or (language is not None and language.endswith("-header")) or ("-Xclang", "-emit-pch") in remaining_args:
+        operation_type = "pch"
+        if language is None and compiler_variable(command[0]) == "CXX":
+            # A C++ driver compiles the header as C++ whatever its extension
+            remaining_args.append(("-x", "c++-header"))
+
     args: T.List[T.Union[str, T.Tuple[str, ...]]] = []
     for arg in remaining_args:
-        if arg.startswith("-"):
+        if isinstance(arg, tuple) or arg.startswith("-"):
             args.append(arg)
         else:
-            if operation_type == "compile":
-                if arg.endswith((".c", ".cpp", ".cc", ".C", ".s", ".S", ".asm", ".rc")):
+            if operation_type == "compile" or operation_type == "pch":
+                if arg.endswith(SOURCE_EXTENSIONS if operation_type == "compile" else PCH_INPUT_EXTENSIONS):
                     inputfiles.append(os.path.join(cwd, arg))
                 elif len(args) > 0:
                     if isinstance(args[-1], tuple):
@@ -223,271 +264,541 @@ def extract_archiver_command(command: T.List[str], cwd: str) -> T.Tuple[T.Litera
 
     return "archive", args, inputfiles, outputfile
 
-def check_deps(commands: T.List[T.List[T.Any]], i: int, current_num: int) -> bool:
-    for j in range(i, len(commands)):
-        if commands[j][0] != current_num:
-            # The parallelization is discontinued here, no need to look after
-            return True
-        if len(commands) < 6:
-            continue  # can not happen, a non-compile command should break the parallelization
-        if commands[i][6] in commands[j][5]:
-            return False  # Our inputfile is used later, we need to break the parallelization
-    return True
-
-
-def used_unused(group: T.Dict[str, T.Any], group_deps: T.Dict[str, T.Any]) -> T.Tuple[T.Set[str], T.Set[str]]:
-    required_files = set(flatten([file["dependencies"] for file in group["files"]]))
-    deps_files = {file["output"] for file in group_deps["files"]}
-
-    return required_files.intersection(deps_files), deps_files.difference(required_files)
-
+def split_partially_used_groups(groups: T.List[Group]) -> T.List[Group]:
+    # A group must be either entirely used or entirely unused by each of the groups that follow it,
+    # otherwise the link steps would take objects they don't need.
+    # The files of each group are split according to the set of groups that consume them.
+    producers: T.Dict[str, int] = {}
+    for i, group in enumerate(groups):
+        for file in group.files:
+            producers[file.output] = i
+
+    consumers: T.Dict[str, T.List[int]] = {}
+    for j, group in enumerate(groups):
+        for file in group.files:
+            for dep in file.dependencies:
+                producer = producers.get(dep)
+                if producer is None or producer > j:
+                    continue
+                if dep not in consumers:
+                    consumers[dep] = []
+                if len(consumers[dep]) == 0 or consumers[dep][-1] != j:
+                    consumers[dep].append(j)
+
+    partitioned_groups: T.List[Group] = []
+    for group in groups:
+        parts: T.Dict[T.Tuple[int, ...], T.List[GroupFile]] = {}
+        for file in group.files:
+            signature = tuple(consumers.get(file.output, ()))
+            if signature not in parts:
+                parts[signature] = []
+            parts[signature].append(file)
+        if len(parts) <= 1:
+            partitioned_groups.append(group)
+            continue
+        # Looking at the consumers in order, the files a consumer doesn't use come before the ones it uses
+        for signature in sorted(parts, key=lambda signature: (*(-j for j in signature), -len(groups))):
+            partitioned_groups.append(group.with_files(parts[signature]))
 
+    return partitioned_groups
 
-def create_compilation_groups(entries: T.List[T.Tuple[str, str]]) -> T.List[T.Dict[str, T.Any]]:
-    commands: T.List[T.List[T.Any]] = []
 
-    commands_to_filters = (makefile_dry_run.sh_which_cache("mkdir") or "mkdir", makefile_dry_run.sh_which_cache("echo") or "echo", makefile_dry_run.sh_which_cache("printf") or "printf")
-    _output_set = set()
+def classify_commands(entries: T.Iterable[T.Tuple[str, str]], launchers: T.Union[T.Dict[str, T.Tuple[str, str]], None] = None) -> T.Iterator[T.Union[ToolCommand, ShellCommand]]:
+    # The compiler launchers found (ccache, sccache, distcc, icecc) are added to `launchers`,
+    # indexed by the environment variable of the compiler they launch: {"CC": (launcher, compiler)}
     for entry in entries:
-        outputfile = None
-        command = shlex.split(entry[1])
+        command = parse_command(entry[1]).args
         if len(command) == 0:
             continue
+        if len(command) > 1 and is_launcher(command[0]) and is_compiler(command[1]):
+            if launchers is not None:
+                launchers.setdefault(compiler_variable(command[1]), (command[0], command[1]))
+            command = command[1:]
         if is_compiler(command[0]):
-            cmd = [0, *extract_compiler_command(command, entry[0])]
-            outputfile = cmd[6]
+            yield ToolCommand(*extract_compiler_command(command, entry[0]))
         elif is_archiver(command[0]):
-            cmd = [0, *extract_archiver_command(command, entry[0])]
-            outputfile = cmd[4]
-        elif makefile_dry_run.sh_which_cache(command[0]) in commands_to_filters:
+            operation_type, args, inputfiles, outputfile = extract_archiver_command(command, entry[0])
+            yield ToolCommand(operation_type, [], [], args, inputfiles, outputfile)
+        elif toolchain.binary_kind(command[0]) == "filtered":
             # don't keep mkdir, echo and printf, PowerMake will do most of them anyway
             continue
         else:
-            commands.append([0, entry[1], entry[0]])
-            continue
-
-        if outputfile is not None and outputfile not in _output_set:
-            _output_set.add(outputfile)
-            commands.append(cmd)
+            yield ShellCommand(entry[1], entry[0])
 
-    current_num = 0
-    for i in range(len(commands)-1, -1, -1):
-        if len(commands[i]) == 2 or commands[i][1] != "compile":
-            current_num += 1
-            commands[i][0] = current_num
-            current_num += 1
-            continue
-        if not check_deps(commands, i, current_num):
-            current_num += 1
-        commands[i][0] = current_num
 
-    commands.sort(reverse=True)
+def create_compilation_groups(entries: T.Iterable[T.Tuple[str, str]], launchers: T.Union[T.Dict[str, T.Tuple[str, str]], None] = None, store: T.Union[SpillStore, None] = None) -> T.Iterable[Group]:
+    # With a `store`, the commands are kept on disk and the groups are read back from it one at a time
+    if store is not None:
+        store.add_commands(classify_commands(entries, launchers))
+        store.create_groups()
+        return store.iter_groups()
 
-    groups: T.List[T.Dict[str, T.Any]] = []
+    commands: T.List[T.Union[ToolCommand, ShellCommand]] = []
+    _output_set = set()
+    for cmd in classify_commands(entries, launchers):
+        if isinstance(cmd, ShellCommand):
+            commands.append(cmd)
+        elif cmd.outputfile is not None and cmd.outputfile not in _output_set:
+            _output_set.add(cmd.outputfile)
+            commands.append(cmd)
 
-    group_n = -1
-    group_template = None
+    # The groups are ordered by stages of independent groups, see schedule
+    groups = schedule_commands(commands)
+    return split_partially_used_groups(groups)
 
-    for command in commands:
-        if len(command) == 3:
-            groups.append({"operation_type": "command", "defines": [], "includedirs": [], "args": [], "files": [], "command": command[1], "command_cwd": command[2]})
-            group_n += 1
-            group_template = command
-            continue
-        if command[1] == "archive":
-            groups.append({"operation_type": "archive", "defines": [], "includedirs": [], "args": command[2], "files": [{"dependencies": command[3], "output": command[4]}], "command": None, "command_cwd": None})
-            group_n += 1
-            group_template = command
-            continue
-        if group_template is None or group_template[:5] != command[:5] or command[1] != "compile":
-            groups.append({"operation_type": command[1], "defines": command[2], "includedirs": command[3], "args": command[4], "files": [], "command": None, "command_cwd": None})
-            group_n += 1
-            group_template = command
-        groups[group_n]["files"].append({"dependencies": command[5], "output": command[6]})
-
-    i = 0
-    while i < len(groups):
-        must_split = False
-        used: T.Set[str] = set()
-        unused: T.Set[str] = set()
-        for j in range(i, len(groups)):
-            used, unused = used_unused(groups[j], groups[i])
-            if len(used) > 0 and len(unused) > 0:
-                must_split = True
-                break
-        if must_split:
-            group = groups.pop(i)
-            group1 = {"operation_type": group["operation_type"], "defines": group["defines"], "includedirs": group["includedirs"], "args": group["args"], "command": group["command"], "command_cwd": group["command_cwd"], "files": []}
-            group2 = {**group1, "files": []}
-            for file in group["files"]:
-                if file["output"] in used:
-                    group1["files"].append(file)
-                else:
-                    group2["files"].append(file)
-            groups.insert(i, group1)
-            groups.insert(i, group2)
-        else:
-            i += 1
+# The defines, include dirs and flags set in the config, by the name used in its methods (add_defines...)
+FunctionState = T.Dict[str, T.Sequence[T.Union[str, T.Tuple[str, ...]]]]
 
-    return groups
 
-def create_instructions(groups: T.List[T.Dict[str, T.Any]]) -> T.Tuple[T.Union[str, None], int, T.List[str]]:
-    instructions: T.List[str] = []
-    last_function_state: T.Dict[str, T.List[T.Union[str, T.Tuple[str, ...]]]] = {"defines": [], "includedirs": [], "c_flags": [], "cpp_flags": [], "as_flags": [], "asm_flags": [], "rc_flags": [], "ld_flags": [], "shared_linker_flags": [], "ar_flags": []}
+def translate_groups(groups: T.Iterable[Group], emit: T.Callable[[str], None], warnings: T.Union[T.List[str], SpilledWarnings, None] = None, objects_variables: T.Union[T.Dict[str, int], SpilledObjectsVariables, None] = None, parallel_stages: bool = False) -> T.Tuple[T.Union[str, None], int]:
+    # Each instruction is given to `emit` as soon as it's made, the project name and the number of operations are returned.
+    # The instructions that must be verified (the `run_command` ones) are added to `warnings`, see print_warnings.
+    # The groups of a stage run one after the other, or at the same time with `parallel_stages` (see PARALLEL_CODE)
+    last_function_state: FunctionState = {"defines": [], "includedirs": [], "c_flags": [], "cpp_flags": [], "as_flags": [], "asm_flags": [], "rc_flags": [], "ld_flags": [], "shared_linker_flags": [], "ar_flags": []}
     archives_variables: T.Dict[str, str] = {}
     archives_var_counter = 0
     shared_libs_variables: T.Dict[str, str] = {}
     shared_libs_var_counter = 0
-    objects_variables: T.Dict[str, T.Set[str]] = {}
+    # Index of the objectsN variable that contains each object, the variables never share an object
+    if objects_variables is None:
+        objects_variables = {}
     objects_var_counter = 0
+    steps_counter = 0
     project_name: T.Union[str, None] = None
     instructions_count = 0
-    for group in groups:
-        function_state = {**last_function_state}
-
-        instructions_count += len(group["files"])
 
-        if group["operation_type"] == "command":
-            instructions.append(f"powermake.run_command(config, {json.dumps(group['command'])}, shell=True, cwd={json.dumps(group['command_cwd'])})")
-            print("\033[0;33mWarning:\033[0;m Verify this line in the generated powermake:")
-            print(f"\033[2;37m{instructions[-1]}\033[0;m")
-            continue
+    def translate_group(group: Group, last_function_state: FunctionState, emit: T.Callable[[str], None], emit_variable: T.Callable[[str], None]) -> T.Tuple[FunctionState, T.Union[str, None], str]:
+        # The config changes and the preparation of the call go to `emit`, the objectsN variables used by the next groups go to `emit_variable`.
+        # The call itself is returned with the variable it must be assigned to.
+        nonlocal archives_var_counter, shared_libs_var_counter, objects_var_counter, project_name
+        function_state = {**last_function_state}
 
-        elif group["operation_type"] == "compile":
-            function_state["defines"] = group["defines"]
-            function_state["includedirs"] = group["includedirs"]
-            for file in group["files"]:
-                for dep in file["dependencies"]:
+        if group.operation_type == "compile":
+            function_state["defines"] = group.defines
+            function_state["includedirs"] = group.includedirs
+            for file in group.files:
+                for dep in file.dependencies:
                     if dep.endswith(".c"):
-                        function_state["c_flags"] = group["args"]
+                        function_state["c_flags"] = group.args
                     elif dep.endswith((".cpp", ".cc", ".C")):
-                        function_state["cpp_flags"] = group["args"]
+                        function_state["cpp_flags"] = group.args
                     elif dep.endswith((".s", ".S")):
-                        function_state["as_flags"] = group["args"]
+                        function_state["as_flags"] = group.args
                     elif dep.endswith(".asm"):
-                        function_state["asm_flags"] = group["args"]
+                        function_state["asm_flags"] = group.args
                     elif dep.endswith(".rc"):
-                        function_state["rc_flags"] = group["args"]
+                        function_state["rc_flags"] = group.args
                     else:
                         print("error, unhandled file extension:", dep)
                         exit(1)
-        elif group["operation_type"] == "link":
-            function_state["ld_flags"] = group["args"]
-        elif group["operation_type"] == "shared_link":
-            function_state["shared_linker_flags"] = group["args"]
-        elif group["operation_type"] == "archive":
-            function_state["ar_flags"] = group["args"]
+        elif group.operation_type == "pch":
+            # The header is compiled by precompile_header (see PCH_CODE) with the flags of the config, -x is given apart
+            pch_language = pch_header_language(group)
+            function_state["defines"] = group.defines
+            function_state["includedirs"] = group.includedirs
+            function_state["c_flags" if pch_language == "c-header" else "cpp_flags"] = [arg for arg in group.args if not (isinstance(arg, tuple) and arg[0] == "-x")]
+        elif group.operation_type == "link":
+            function_state["ld_flags"] = group.args
+        elif group.operation_type == "shared_link":
+            function_state["shared_linker_flags"] = group.args
+        elif group.operation_type == "archive":
+            function_state["ar_flags"] = group.args
 
         for key in last_function_state:
             to_add = set(function_state[key]).difference(last_function_state[key])
             to_remove = set(last_function_state[key]).difference(function_state[key])
             if len(to_add) > 0:
-                instructions.append(f"config.add_{key}({str([arg for arg in function_state[key] if arg in to_add])[1:-1]})")
+                emit(f"config.add_{key}({str([arg for arg in function_state[key] if arg in to_add])[1:-1]})")
             if len(to_remove) > 0:
-                instructions.append(f"config.remove_{key}({str(to_remove)[1:-1]})")
+                emit(f"config.remove_{key}({str(to_remove)[1:-1]})")
 
-        if group["operation_type"] == "compile":
-            to_get, to_filter = get_best_glob_match(flatten([file["dependencies"] for file in group["files"]]))
+        if group.operation_type == "pch":
+            pch_file = group.files[0]
+            pch_includes = [arg[1] for arg in group.args if isinstance(arg, tuple) and arg[0] == "-include"]
+            return function_state, None, f"precompile_header(config, {json.dumps(pch_language)}, {json.dumps(pch_file.dependencies[0])}, {json.dumps(pch_file.output)}, {json.dumps(pch_includes)})"
+
+        elif group.operation_type == "compile":
+            with profiling.phase("glob_inference"):
+                to_get, to_filter = get_best_glob_match(flatten([file.dependencies for file in group.files]))
 
             if len(to_filter) == 0:
-                instructions.append("files = powermake.get_files(" + str(to_get)[1:-1] + ")")
+                emit("files = powermake.get_files(" + str(to_get)[1:-1] + ")")
             else:
-                instructions.append("files = powermake.filter_files(powermake.get_files(" + str(to_get)[1:-1] + "), " + str(to_filter)[1:-1] + ")")
+                emit("files = powermake.filter_files(powermake.get_files(" + str(to_get)[1:-1] + "), " + str(to_filter)[1:-1] + ")")
 
             objects_var_counter += 1
-            objects_variables[f"objects{objects_var_counter}"] = {file["output"] for file in group["files"]}
-            instructions.append(f"objects{objects_var_counter} = powermake.compile_files(config, files)")
-
-        else:
-            target_name = os.path.splitext(os.path.basename(next(iter(group["files"]))["output"]))[0]
-            if project_name is None:
-                project_name = target_name
-            variables_names: T.Set[str] = set()
-            variables_union: T.Set[str] = set()
-            count = objects_var_counter
-            required_mixed = flatten([file["dependencies"] for file in group["files"]])
-            required_objects = {obj for obj in required_mixed if not obj.endswith(".a") and not is_so_version(obj)}
-            required_archives = [os.path.splitext(os.path.basename(archive))[0] for archive in required_mixed if archive.endswith(".a")]
-            required_shared_libs = [os.path.splitext(os.path.basename(lib))[0] for lib in required_mixed if is_so_version(lib)]
-
-            archives_variables_list = []
-            for archive in required_archives:
-                if archive in archives_variables:
-                    archives_variables_list.append(archives_variables[archive])
-            for lib in required_shared_libs:
-                if lib in shared_libs_variables:
-                    archives_variables_list.append(shared_libs_variables[lib])
-
-            while count > 0 and len(required_objects.difference(variables_union)) > 0:
-                if len(objects_variables[f"objects{count}"].intersection(required_objects)) > 0 and len(objects_variables[f"objects{count}"].difference(variables_union)) > 0:
-                    variables_names.add(f"objects{count}")
-                    variables_union.update(objects_variables[f"objects{count}"])
-                count -= 1
-            diffs = required_objects.difference(variables_union)
-            if len(diffs) > 0:
+            for file in group.files:
+                objects_variables[file.output] = objects_var_counter
+            return function_state, f"objects{objects_var_counter}", "powermake.compile_files(config, files)"
+
+        target_name = os.path.splitext(os.path.basename(next(iter(group.files)).output))[0]
+        if project_name is None:
+            project_name = target_name
+        required_mixed = flatten([file.dependencies for file in group.files])
+        required_objects = {obj for obj in required_mixed if not obj.endswith(".a") and not is_so_version(obj)}
+        required_archives = [os.path.splitext(os.path.basename(archive))[0] for archive in required_mixed if archive.endswith(".a")]
+        required_shared_libs = [os.path.splitext(os.path.basename(lib))[0] for lib in required_mixed if is_so_version(lib)]
+
+        archives_variables_list = []
+        for archive in required_archives:
+            if archive in archives_variables:
+                archives_variables_list.append(archives_variables[archive])
+        for lib in required_shared_libs:
+            if lib in shared_libs_variables:
+                archives_variables_list.append(shared_libs_variables[lib])
+
+        variables_counters: T.Set[int] = set()
+        diffs: T.Set[str] = set()
+        for obj in required_objects:
+            if obj in objects_variables:
+                variables_counters.add(objects_variables[obj])
+            else:
+                diffs.add(obj)
+        variables_names = [f"objects{count}" for count in sorted(variables_counters, reverse=True)]
+        if len(diffs) > 0:
+            with profiling.phase("glob_inference"):
                 to_get, to_filter = get_best_glob_match(diffs)
-                objects_var_counter += 1
-                if len(to_filter) == 0:
-                    instructions.append(f"objects{objects_var_counter} = powermake.get_files(" + str(to_get)[1:-1] + ")")
-                else:
-                    instructions.append(f"objects{objects_var_counter} = powermake.filter_files(powermake.get_files(" + str(to_get)[1:-1] + "), " + str(to_filter)[1:-1] + ")")
-                objects_variables[f"objects{objects_var_counter}"] = diffs
-                variables_names.add(f"objects{objects_var_counter}")
-
-            if len(variables_names) < 1:
-                print("fatal error")
-                exit(1)
-            objects_var = next(iter(variables_names))
-            variables_names.remove(objects_var)
-            if len(variables_names) > 0:
-                objects_var = f"{objects_var}.union("
-                for name in variables_names:
-                    objects_var += name + ", "
-                objects_var = objects_var[:-2] + ')'
-
-            archives_list_str = ""
-            if len(archives_variables_list) > 0:
-                for archive in archives_variables_list:
-                    archives_list_str += archive + ", "
-                archives_list_str = ", archives=[" + archives_list_str[:-2] + "]"
-
-            if group["operation_type"] == "link" or group["operation_type"] == "unknown":
-                project_name = target_name
-                instructions.append(f"powermake.link_files(config, {objects_var}{archives_list_str}, executable_name={json.dumps(target_name)})")
-            elif group["operation_type"] == "shared_link":
-                shared_libs_var_counter += 1
-                shared_libs_variables[target_name] = f"shared_lib{shared_libs_var_counter}"
-                instructions.append(f"shared_lib{shared_libs_var_counter} = powermake.link_shared_lib(config, {objects_var}{archives_list_str}, lib_name={json.dumps(target_name)})")
-            elif group["operation_type"] == "archive":
-                archives_var_counter += 1
-                archives_variables[target_name] = f"archives{archives_var_counter}"
-                instructions.append(f"archives{archives_var_counter} = powermake.archive_files(config, {objects_var}, archive_name={json.dumps(target_name)})")
-
-
-        last_function_state = function_state
+            objects_var_counter += 1
+            if len(to_filter) == 0:
+                emit_variable(f"objects{objects_var_counter} = powermake.get_files(" + str(to_get)[1:-1] + ")")
+            else:
+                emit_variable(f"objects{objects_var_counter} = powermake.filter_files(powermake.get_files(" + str(to_get)[1:-1] + "), " + str(to_filter)[1:-1] + ")")
+            for obj in diffs:
+                objects_variables[obj] = objects_var_counter
+            variables_names.append(f"objects{objects_var_counter}")
+
+        if len(variables_names) < 1:
+            print("fatal error")
+            exit(1)
+        objects_var = variables_names[0]
+        if len(variables_names) > 1:
+            objects_var = f"{objects_var}.union({', '.join(variables_names[1:])})"
+
+        archives_list_str = ""
+        if len(archives_variables_list) > 0:
+            archives_list_str = f", archives=[{', '.join(archives_variables_list)}]"
+
+        if group.operation_type == "shared_link":
+            shared_libs_var_counter += 1
+            shared_libs_variables[target_name] = f"shared_lib{shared_libs_var_counter}"
+            return function_state, f"shared_lib{shared_libs_var_counter}", f"powermake.link_shared_lib(config, {objects_var}{archives_list_str}, lib_name={json.dumps(target_name)})"
+        if group.operation_type == "archive":
+            archives_var_counter += 1
+            archives_variables[target_name] = f"archives{archives_var_counter}"
+            return function_state, f"archives{archives_var_counter}", f"powermake.archive_files(config, {objects_var}, archive_name={json.dumps(target_name)})"
+        project_name = target_name
+        return function_state, None, f"powermake.link_files(config, {objects_var}{archives_list_str}, executable_name={json.dumps(target_name)})"
+
+    for stage in iter_stages(groups):
+        for group in stage:
+            instructions_count += len(group.files)
+
+        if stage[0].operation_type == "command":
+            instruction = f"powermake.run_command(config, {json.dumps(stage[0].command)}, shell=True, cwd={json.dumps(stage[0].command_cwd)})"
+            emit(instruction)
+            if warnings is not None:
+                warnings.append(instruction)
+            continue
 
-    return project_name, instructions_count, instructions
+        if len(stage) == 1:
+            last_function_state, variable, call = translate_group(stage[0], last_function_state, emit, emit)
+            emit(call if variable is None else f"{variable} = {call}")
+            continue
 
+        # Independent groups, each one is a step run on its own copy of the config, one after the other or by run_in_parallel
+        # (see PARALLEL_CODE), the config of on_build doesn't change (PowerMake ignores a flag added again after it was removed)
+        variables = []
+        steps = []
+        for group in stage:
+            lines: T.List[str] = []
+            _, variable, call = translate_group(group, last_function_state, lines.append, emit)
+            steps_counter += 1
+            emit(f"def step{steps_counter}(config: powermake.Config) -> T.Any:" + "".join(f"\n        {line}" for line in lines) + f"\n        return {call}")
+            variables.append("_" if variable is None else variable)
+            steps.append(f"(step{steps_counter}, {len(group.files)})")
+            if not parallel_stages:
+                emit(f"step{steps_counter}(config.copy())" if variable is None else f"{variable} = step{steps_counter}(config.copy())")
+        if not parallel_stages:
+            continue
+        if all(variable == "_" for variable in variables):
+            emit(f"run_in_parallel(config, {', '.join(steps)})")
+        else:
+            emit(f"{', '.join(variables)} = run_in_parallel(config, {', '.join(steps)})")
 
-def generate_code(makefile_folder: str) -> str:
-    entries = makefile_dry_run.list_commands(["make"], makefile_folder)
-    groups = create_compilation_groups(entries)
+    return project_name, instructions_count
 
 
-    project_name, instructions_count, instructions = create_instructions(groups)
-    if project_name is None:
-        project_name = "PROJECT_NAME"
+def create_instructions(groups: T.Iterable[Group], warnings: T.Union[T.List[str], None] = None, parallel_stages: bool = False) -> T.Tuple[T.Union[str, None], int, T.List[str]]:
+    instructions: T.List[str] = []
+    project_name, instructions_count = translate_groups(groups, instructions.append, warnings, parallel_stages=parallel_stages)
+    return project_name, instructions_count, instructions
 
-    code = "import powermake\n\n\n"
 
-    code += "def on_build(config: powermake.Config) -> None:\n"
-    code += f"    config.nb_total_operations = {instructions_count}\n\n"
+# Added to the generated PowerMake when the Makefile ran its compilers through a launcher.
+# It's called at the start of on_build, so cleaning or --help write nothing: the compiler of the config is pointed
+# to a script that runs the launcher with the compiler, unless CC/CXX chose another compiler.
+LAUNCHER_CODE = """def use_compiler_launcher(config: powermake.Config, variable: str, launcher: str, compiler: str) -> None:
+    # The translated Makefile ran `compiler` through `launcher`, keep its cache or its distributed compilation
+    launcher_path = shutil.which(launcher)
+    compiler_path = shutil.which(compiler)
+    if variable in os.environ or launcher_path is None or compiler_path is None:
+        return
+    wrapper = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "launcher", os.path.basename(compiler))
+    os.makedirs(os.path.dirname(wrapper), exist_ok=True)
+    with open(wrapper, "w") as file:
+        file.write(f'#!/bin/sh\\nexec {shlex.quote(launcher_path)} {shlex.quote(compiler_path)} "$@"\\n')
+    os.chmod(wrapper, 0o755)
+    (config.cpp_compiler if variable == "CXX" else config.c_compiler).path = wrapper
+
+"""
+
+
+# Added to the generated PowerMake with --parallel-stages, when some groups don't depend on each other (see schedule).
+# The jobs are shared between the steps according to their number of operations, the first ones are on the critical path.
+# The steps call PowerMake from several threads at the same time, each with its own copy of the config: PowerMake doesn't
+# say that its shared state (the count of the operations, the creation of the object folders...) supports it, so it's opt-in.
+PARALLEL_CODE = """def run_in_parallel(config: powermake.Config, *steps: T.Tuple[T.Callable[[powermake.Config], T.Any], int]) -> T.List[T.Any]:
+    # Each step runs on its own copy of the config, the results are returned in the order of the steps
+    total = sum(operations for _, operations in steps)
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(len(steps), config.nb_jobs))) as executor:
+        futures = []
+        for step, operations in steps:
+            step_config = config.copy()
+            step_config.nb_jobs = max(1, config.nb_jobs * operations // total)
+            futures.append(executor.submit(step, step_config))
+        return [future.result() for future in futures]
+
+"""
+
+
+# Added to the generated PowerMake when the Makefile used precompiled headers.
+# The compiler only uses a precompiled header made with the same flags, so it's compiled with the compiler and the flags
+# PowerMake gives to the sources, at the place the Makefile put it (next to the header or where -include-pch looks for it).
+PCH_CODE = """def precompile_header(config: powermake.Config, language: str, source: str, pch: str, dependencies: T.List[str]) -> None:
+    if language == "c-header":
+        compiler, flags = config.c_compiler, config.c_flags
+    else:
+        compiler, flags = config.cpp_compiler, config.cpp_flags
+    args = compiler.format_args(config.defines, config.additional_includedirs, flags)
+    powermake.run_command_if_needed(config, pch, [source, *dependencies], [compiler.path, "-x", language, *args, "-o", pch, "-c", source])
+
+"""
+
+
+def write_header(file: T.TextIO, instructions_count: int, launchers: T.Dict[str, T.Tuple[str, str]], use_pch: bool, use_parallel: bool = False, use_steps: bool = False) -> None:
+    # Everything before the instructions of on_build
+    if use_parallel:
+        file.write("import concurrent.futures\n")
+    if len(launchers) > 0:
+        file.write("import os\nimport shlex\nimport shutil\n")
+    if use_pch or use_parallel or use_steps:
+        file.write("import typing as T\n")
+    file.write("import powermake\n\n\n")
+    if len(launchers) > 0:
+        file.write(LAUNCHER_CODE + "\n")
+    if use_pch:
+        file.write(PCH_CODE + "\n")
+    if use_parallel:
+        file.write(PARALLEL_CODE + "\n")
+
+    file.write("def on_build(config: powermake.Config) -> None:\n")
+    file.write(f"    config.nb_total_operations = {instructions_count}\n\n")
+    for variable, (launcher, compiler) in sorted(launchers.items()):
+        write_instruction(file, f"use_compiler_launcher(config, {json.dumps(variable)}, {json.dumps(launcher)}, {json.dumps(compiler)})")
+
+
+def write_instruction(file: T.TextIO, instruction: str) -> None:
+    file.write(f"    {instruction}\n\n")
+
+
+def write_footer(file: T.TextIO, project_name: str) -> None:
+    file.write(f"\n\npowermake.run({json.dumps(project_name)}, build_callback=on_build)\n")
+
+
+def write_code(file: T.TextIO, project_name: str, instructions_count: int, instructions: T.List[str], launchers: T.Union[T.Dict[str, T.Tuple[str, str]], None] = None) -> None:
+    # The generated PowerMake is written piece by piece, it's never held in memory as a whole
+    if launchers is None:
+        launchers = {}
+    use_pch = any(instruction.startswith("precompile_header(") for instruction in instructions)
+    use_parallel = any("run_in_parallel(config, " in instruction for instruction in instructions)
+    use_steps = any(instruction.startswith("def step") for instruction in instructions)
+    write_header(file, instructions_count, launchers, use_pch, use_parallel, use_steps)
     for instruction in instructions:
-        code += f"    {instruction}\n\n"
-
-    code += f"\n\npowermake.run({json.dumps(project_name)}, build_callback=on_build)\n"
-
-    return code
+        write_instruction(file, instruction)
+    write_footer(file, project_name)
+
+
+def emit_code(project_name: str, instructions_count: int, instructions: T.List[str], launchers: T.Union[T.Dict[str, T.Tuple[str, str]], None] = None) -> str:
+    code = io.StringIO()
+    write_code(code, project_name, instructions_count, instructions, launchers)
+    return code.getvalue()
+
+
+def print_parallelism(groups: T.List[Group], jobs: int, parallel_stages: bool) -> None:
+    # Estimated with every command taking the same time, see schedule
+    operations = sum(len(group.files) for group in groups)
+    if operations == 0:
+        return
+    make = make_steps(groups, jobs)
+    generated = powermake_steps(groups, jobs, parallel_stages)
+    other = powermake_steps(groups, jobs, not parallel_stages)
+    print(f"Estimated parallelism with {jobs} jobs, every command taking the same time:")
+    print(f"  make -j{jobs}:          {operations / make:6.2f} ({operations} commands in {make} steps)")
+    print(f"  generated PowerMake: {operations / generated:6.2f} ({generated} steps, {other} {'with its groups one after the other' if parallel_stages else 'with --parallel-stages'})")
+
+
+def print_warnings(warnings: T.Union[T.List[str], SpilledWarnings]) -> None:
+    if len(warnings) == 0:
+        return
+    print(f"\033[0;33mWarning:\033[0;m Verify {'this line' if len(warnings) == 1 else f'these {len(warnings)} lines'} in the generated powermake:")
+    for warning in warnings:
+        print(f"\033[2;37m{warning}\033[0;m")
+
+
+def generate_code(makefile_folder: str, output_path: str, jobs: int = 1, record_trace: T.Union[str, None] = None, use_compile_commands: bool = False, cache_dir: T.Union[str, None] = None, make_database: bool = False, time_budget: T.Union[float, None] = DEFAULT_TIME_BUDGET, max_memory: T.Union[int, None] = None, parallel_stages: bool = False, estimate_parallelism: bool = False) -> None:
+    # With `max_memory` (in bytes), the commands, the groups and the objects are spilled to a SQLite database (see spill_store)
+    if max_memory is not None:
+        with SpillStore(max_memory) as store:
+            return _generate_code(makefile_folder, output_path, jobs, record_trace, use_compile_commands, cache_dir, make_database, time_budget, store, parallel_stages, estimate_parallelism)
+    return _generate_code(makefile_folder, output_path, jobs, record_trace, use_compile_commands, cache_dir, make_database, time_budget, None, parallel_stages, estimate_parallelism)
+
+
+def _generate_code(makefile_folder: str, output_path: str, jobs: int, record_trace: T.Union[str, None], use_compile_commands: bool, cache_dir: T.Union[str, None], make_database: bool, time_budget: T.Union[float, None], store: T.Union[SpillStore, None], parallel_stages: bool, estimate_parallelism: bool) -> None:
+    if use_compile_commands and os.path.isdir(makefile_folder):
+        makefile_folder = os.path.join(makefile_folder, "compile_commands.json")
+
+    entries: T.Iterable[T.Tuple[str, str]]
+    if dry_run_trace.is_trace_file(makefile_folder):
+        if store is None:
+            with profiling.phase("load_commands"):
+                entries = dry_run_trace.load_trace(makefile_folder)
+        else:
+            entries = profiling.iter_phase("load_commands", dry_run_trace.iter_trace(makefile_folder))
+    elif os.path.isfile(makefile_folder) and makefile_folder.endswith(".json"):
+        with profiling.phase("load_commands"):
+            entries = compile_commands.list_commands(makefile_folder)
+    else:
+        # The commands are classified while make is still printing them
+        cache = None if cache_dir is None else DryRunCache(cache_dir)
+        engine = MakeDatabaseEngine(time_budget) if make_database else None
+        # The replays of the sub-make dry runs are bounded too in the spilled mode, ~1KiB each
+        memo = makefile_dry_run.DryRunMemo(cache=cache) if store is None else makefile_dry_run.DryRunMemo(max_replay_size=store.max_memory // 8 // 1024, max_replay_total=store.max_memory // 4 // 1024, cache=cache)
+        entries = makefile_dry_run.iter_commands(["make"], makefile_folder, jobs, memo, engine)
+        entries = profiling.iter_phase("dry_run", entries)
+    if record_trace is not None:
+        entries = dry_run_trace.record_trace(record_trace, entries)
+    with profiling.phase("grouping"):
+        launchers: T.Dict[str, T.Tuple[str, str]] = {}
+        groups = create_compilation_groups(entries, launchers, store)
+
+    # Written next to the output and renamed, a failed translation doesn't leave half a PowerMake behind
+    temporary_path = output_path + ".tmp"
+    warnings: T.Union[T.List[str], SpilledWarnings]
+    try:
+        if store is None:
+            warnings = []
+            with profiling.phase("instructions"):
+                project_name, instructions_count, instructions = create_instructions(groups, warnings, parallel_stages)
+
+            with profiling.phase("emit"):
+                with open(temporary_path, "w") as file:
+                    write_code(file, project_name or "PROJECT_NAME", instructions_count, instructions, launchers)
+        else:
+            # The instructions are written as soon as they are made, to a scratch file since the header depends on them,
+            # the number of operations is known from the store
+            warnings = store.warnings
+            use_parallel = False
+            use_steps = False
+
+            def write_body_instruction(instruction: str) -> None:
+                nonlocal use_parallel, use_steps
+                use_parallel = use_parallel or "run_in_parallel(config, " in instruction
+                use_steps = use_steps or instruction.startswith("def step")
+                write_instruction(body, instruction)
+
+            with tempfile.TemporaryFile("w+", prefix="makefile_to_powermake_") as body:
+                with profiling.phase("instructions"):
+                    project_name, _ = translate_groups(profiling.iter_phase("grouping", groups), write_body_instruction, warnings, store.objects_variables, parallel_stages)
+                body.seek(0)
+                with open(temporary_path, "w") as file:
+                    write_header(file, store.tool_commands_count(), launchers, store.has_operation("pch"), use_parallel, use_steps)
+                    shutil.copyfileobj(body, file)
+                    write_footer(file, project_name or "PROJECT_NAME")
+        os.replace(temporary_path, output_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    print_warnings(warnings)
+    if estimate_parallelism and store is None:
+        print_parallelism(T.cast(T.List[Group], groups), jobs, parallel_stages)
+
+
+def read_manifest(path: str) -> T.List[str]:
+    # One project per line, relative to the manifest, empty lines and `#` comments are ignored
+    folders = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.split('#', 1)[0].strip()
+            if line != "":
+                folders.append(os.path.join(os.path.dirname(os.path.abspath(path)), os.path.expanduser(line)))
+    return folders
+
+
+def batch_output_path(makefile_folder: str) -> str:
+    # The generated PowerMake of a project is written next to it
+    if os.path.isdir(makefile_folder):
+        return os.path.join(makefile_folder, "generated.py")
+    return os.path.join(os.path.dirname(os.path.abspath(makefile_folder)), "generated.py")
+
+
+class BatchResult(T.NamedTuple):
+    makefile_folder: str
+    output_path: str
+    success: bool
+    duration: float
+    log: str
+
+
+def translate_project(makefile_folder: str, jobs: int, use_compile_commands: bool, cache_dir: T.Union[str, None], make_database: bool, time_budget: T.Union[float, None], max_memory: T.Union[int, None], parallel_stages: bool, estimate_parallelism: bool) -> BatchResult:
+    # Run in the workers of the batch mode, the messages of the translation are returned to be printed together
+    output_path = batch_output_path(makefile_folder)
+    start = time.perf_counter()
+    log = io.StringIO()
+    success = False
+    with contextlib.redirect_stdout(log):
+        try:
+            generate_code(makefile_folder, output_path, jobs, None, use_compile_commands, cache_dir, make_database, time_budget, max_memory, parallel_stages, estimate_parallelism)
+            success = True
+        except (Exception, SystemExit) as e:
+            print(f"error: {type(e).__name__}: {e}")
+    toolchain.save_cache()
+    return BatchResult(makefile_folder, output_path, success, time.perf_counter() - start, log.getvalue())
+
+
+def translate_batch(makefile_folders: T.List[str], processes: int, jobs: int, use_compile_commands: bool, cache_dir: T.Union[str, None], make_database: bool, time_budget: T.Union[float, None], max_memory: T.Union[int, None], toolchain_cache_path: T.Union[str, None], parallel_stages: bool = False, estimate_parallelism: bool = False) -> T.List[BatchResult]:
+    # The projects are translated in parallel, each worker translates one project at a time and keeps
+    # the binaries it classified for the next ones, they also share the on-disk toolchain cache
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=toolchain.load_cache, initargs=(toolchain_cache_path,)) as executor:
+        futures = [executor.submit(translate_project, folder, jobs, use_compile_commands, cache_dir, make_database, time_budget, max_memory, parallel_stages, estimate_parallelism) for folder in makefile_folders]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            print(f"==> {result.makefile_folder} ({'ok' if result.success else 'failed'}, {result.duration:.2f}s)")
+            if result.log != "":
+                print(result.log, end="" if result.log.endswith("\n") else "\n")
+            results.append(result)
+    results.sort(key=lambda result: makefile_folders.index(result.makefile_folder))
+    return results
+
+
+def print_batch_summary(results: T.List[BatchResult], wall_time: float) -> None:
+    width = max(len(result.makefile_folder) for result in results)
+    print(f"\n{'project':<{width}}  {'status':<7}{'time (s)':>10}  output")
+    for result in results:
+        print(f"{result.makefile_folder:<{width}}  {'ok' if result.success else 'failed':<7}{result.duration:>10.2f}  {result.output_path if result.success else '-'}")
+    succeeded = sum(result.success for result in results)
+    print(f"{succeeded}/{len(results)} translated in {wall_time:.2f}s (the translations took {sum(result.duration for result in results):.2f}s in total)")
 
 
 if __name__ == "__main__":
@@ -501,12 +812,75 @@ if __name__ == "__main__":
     print("==     lines, they will most likely be wrong.     ==")
     print("====================================================\n")
 
-    if len(sys.argv) > 1:
-        makefile_folder = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Translate a Makefile (or a CMake generated Makefile) into a PowerMake")
+    parser.add_argument("makefile_folder", nargs="*", help="folder containing the Makefile to translate, a compile_commands.json or a trace recorded with --record-trace. With several of them, each generated PowerMake is written next to its project")
+    parser.add_argument("-j", "--jobs", type=int, help="maximum number of `make -n -B` started in advance and still running at the same time, for all the levels of sub-makes of a project together, and the jobs of --estimate-parallelism (default: the number of cores, divided between the --processes in batch mode)")
+    parser.add_argument("--manifest", metavar="FILE", help="translate the projects listed in FILE (one per line, relative to FILE), like several makefile folders")
+    parser.add_argument("-P", "--processes", type=int, default=os.cpu_count() or 1, help="number of projects translated at the same time in batch mode")
+    parser.add_argument("--record-trace", metavar="FILE", help="save the dry run commands to FILE (gzip compressed if FILE ends with .gz), it can then be given instead of the makefile folder")
+    parser.add_argument("--no-toolchain-cache", action="store_true", help=f"don't read nor write the cache of the binaries found in PATH ({toolchain.default_cache_path})")
+    parser.add_argument("--cache-dir", metavar="DIR", help="keep the sub-make dry runs in DIR, the next translations only run make again for the Makefiles that changed")
+    parser.add_argument("--compile-commands", action="store_true", help="read the compile commands from the compile_commands.json of the folder instead of dry running make (CMake only)")
+    parser.add_argument("--make-database", action="store_true", help="find the commands by reading the rule database of make (`make -p -q`) instead of dry running it, for the Makefiles that loop with `make -n -B` (automake)")
+    parser.add_argument("--time-budget", type=float, default=DEFAULT_TIME_BUDGET, metavar="SECONDS", help=f"with --make-database, stop with an error if the discovery takes more than SECONDS (default: {DEFAULT_TIME_BUDGET:g}, 0 for no limit)")
+    parser.add_argument("--max-memory", type=int, metavar="MIB", help="keep the commands, the groups and the objects in a temporary SQLite database instead of memory, to translate the biggest projects within about MIB MiB (in each process in batch mode)")
+    parser.add_argument("--parallel-stages", action="store_true", help="run the groups that don't depend on each other at the same time in the generated PowerMake, on threads calling PowerMake together (not known to be safe, by default they run one after the other)")
+    parser.add_argument("--estimate-parallelism", action="store_true", help="print the number of steps of the build with -j jobs, every command taking the same time, for make -jN and the generated PowerMake (not with --max-memory)")
+    parser.add_argument("--profile", action="store_true", help="print the time, the number of calls, of make processes, the bytes read from make and the peak memory of each phase")
+    parser.add_argument("--profile-json", metavar="FILE", help="save the --profile report to FILE as JSON (implies --profile)")
+    parser.add_argument("--profile-pstats", metavar="FILE", help="run the translation under cProfile and save the stats to FILE, to be read with pstats or snakeviz (implies --profile)")
+    args = parser.parse_args()
+    profile = args.profile or args.profile_json is not None or args.profile_pstats is not None
+    toolchain_cache_path = None if args.no_toolchain_cache else toolchain.default_cache_path
+    time_budget = args.time_budget if args.time_budget > 0 else None
+    max_memory = None if args.max_memory is None else args.max_memory * 2**20
+
+    makefile_folders = list(args.makefile_folder)
+    if args.manifest is not None:
+        makefile_folders += read_manifest(args.manifest)
+    if len(makefile_folders) > 1:
+        if profile or args.record_trace is not None:
+            parser.error("--profile and --record-trace only work with a single makefile folder")
+        output_paths = [os.path.realpath(batch_output_path(folder)) for folder in makefile_folders]
+        duplicates = sorted({path for path in output_paths if output_paths.count(path) > 1})
+        if len(duplicates) > 0:
+            parser.error(f"several projects would be written to {', '.join(duplicates)}")
+        processes = max(1, min(args.processes, len(makefile_folders)))
+        jobs = args.jobs if args.jobs is not None else max(1, (os.cpu_count() or 1) // processes)
+        start = time.perf_counter()
+        results = translate_batch(makefile_folders, processes, jobs, args.compile_commands, args.cache_dir, args.make_database, time_budget, max_memory, toolchain_cache_path, args.parallel_stages, args.estimate_parallelism)
+        print_batch_summary(results, time.perf_counter() - start)
+        exit(0 if all(result.success for result in results) else 1)
+
+    if len(makefile_folders) == 1:
+        makefile_folder = makefile_folders[0]
     else:
         makefile_folder = input("Enter makefile's folder path: ")
-
-    code = generate_code(makefile_folder)
-    with open("generated.py", "w") as file:
-        file.write(code)
+    jobs = args.jobs if args.jobs is not None else os.cpu_count() or 1
+
+    if toolchain_cache_path is not None:
+        toolchain.load_cache(toolchain_cache_path)
+
+    if profile:
+        profiling.start()
+    profiler = None
+    if args.profile_pstats is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        generate_code(makefile_folder, "generated.py", jobs, args.record_trace, args.compile_commands, args.cache_dir, args.make_database, time_budget, max_memory, args.parallel_stages, args.estimate_parallelism)
+    except (MakeDatabaseError, makefile_dry_run.MakeRecursionError) as e:
+        print(f"error: {e}")
+        exit(1)
+    toolchain.save_cache()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_pstats)
+    if profile:
+        profiling.stop()
+        profiling.print_report()
+        if args.profile_json is not None:
+            profiling.save_json(args.profile_json)
 
@@ -0,0 +1,757 @@
+import os
+import re
+import sys
+import glob
+import time
+import shlex
+import subprocess
+import typing as T
+
+from shell_tokenizer import parse_command
+import profiling
+
+# Discovery of the commands from the rule database of make (`make -p -q`) instead of `make -n -B`.
+# make only prints its database without running the recipes of the build, so the Makefiles that loop forever with -B
+# (automake) can be read. Like before any build, make still remakes the Makefiles that are out of date (automake's
+# config.status), then starts again and prints a new database. The rules are then walked from the goals like `make -B` would,
+# and their recipes are expanded here, with the variables, the automatic variables and the functions of make.
+# The sub-makes found in the recipes are run the same way by makefile_dry_run.
+
+DEFAULT_TIME_BUDGET = 600.
+
+# Starts with a dot so that it never becomes the default goal
+_EMPTY_GOAL = ".makefile_to_powermake"
+
+# The recipe lines calling $(MAKE) in a shell construction (like the loop on the SUBDIRS of automake) are run
+# by the shell, like `make -n` does, with $(MAKE) replaced by this function that only prints where and how make is called
+_MAKE_REFERENCE_RE = re.compile(r"\$[({]MAKE[)}]")
+_MAKE_STUB = "__makefile_to_powermake_make"
+_MAKE_STUB_CODE = _MAKE_STUB + "() { printf '\\n%s' '" + _EMPTY_GOAL + "'; printf '\\t%s' \"$PWD\" \"$@\"; printf '\\n'; }\n"
+
+_SPECIAL_TARGETS = {".PHONY", ".SUFFIXES", ".DEFAULT", ".PRECIOUS", ".INTERMEDIATE", ".NOTINTERMEDIATE", ".SECONDARY",
+                    ".SECONDEXPANSION", ".DELETE_ON_ERROR", ".IGNORE", ".LOW_RESOLUTION_TIME", ".SILENT",
+                    ".EXPORT_ALL_VARIABLES", ".NOTPARALLEL", ".ONESHELL", ".POSIX", ".WAIT"}
+
+# Options of make followed by a value
+_OPTIONS_WITH_VALUE = {"-C", "--directory", "-f", "--file", "--makefile", "-I", "--include-dir", "-o", "--old-file",
+                       "--assume-old", "-W", "--what-if", "--new-file", "--assume-new"}
+
+_VARIABLE_RE = re.compile(r"^(?P<name>[^\s=#]+) (?P<op>:{0,2})= ?(?P<value>.*)$")
+_TARGET_VARIABLE_RE = re.compile(r"^(?P<target>[^:#\t][^:]*): (?:(?:override|private|export) )*(?P<name>[^\s=]+) (?P<op>\+|\?|:|::|!)?= ?(?P<value>.*)$")
+_PATTERN_VARIABLE_RE = re.compile(r"^# (?:(?:override|private|export) )*(?P<name>[^\s=]+) (?P<op>\+|\?|:|::|!)?= ?(?P<value>.*)$")
+_RULE_RE = re.compile(r"^(?P<targets>[^:#\t][^:]*?)(?P<colons>::?)(?:\s+(?P<prerequisites>.*))?$")
+_STEM_RE = re.compile(r"^#  Implicit/static pattern stem: '(?P<stem>.*)'$")
+
+# name -> (recursive, value)
+Variables = T.Dict[str, T.Tuple[bool, str]]
+
+
+class MakeDatabaseError(Exception):
+    pass
+
+
+class Rule:
+    __slots__ = ("prerequisites", "order_only", "recipe", "stem")
+
+    def __init__(self, prerequisites: T.List[str], order_only: T.List[str], recipe: T.List[str], stem: T.Union[str, None]) -> None:
+        self.prerequisites = prerequisites
+        self.order_only = order_only
+        self.recipe = recipe
+        self.stem = stem
+
+
+class PatternRule:
+    __slots__ = ("targets", "prerequisites", "order_only", "recipe", "terminal")
+
+    def __init__(self, targets: T.List[str], prerequisites: T.List[str], order_only: T.List[str], recipe: T.List[str], terminal: bool) -> None:
+        self.targets = targets
+        self.prerequisites = prerequisites
+        self.order_only = order_only
+        self.recipe = recipe
+        self.terminal = terminal
+
+
+def _split_prerequisites(text: T.Union[str, None]) -> T.Tuple[T.List[str], T.List[str]]:
+    if text is None:
+        return [], []
+    normal, _, order_only = text.partition('|')
+    return normal.split(), order_only.split()
+
+
+def _pattern_stem(pattern: str, word: str) -> T.Union[str, None]:
+    index = pattern.find('%')
+    if index < 0:
+        return "" if pattern == word else None
+    prefix, suffix = pattern[:index], pattern[index + 1:]
+    if len(word) >= len(prefix) + len(suffix) and word.startswith(prefix) and word.endswith(suffix):
+        return word[len(prefix):len(word) - len(suffix)]
+    return None
+
+
+def _patsubst_word(pattern: str, replacement: str, word: str) -> str:
+    stem = _pattern_stem(pattern, word)
+    if stem is None:
+        return word
+    if '%' not in pattern:
+        return replacement
+    return replacement.replace('%', stem, 1)
+
+
+def _split_arguments(text: str, max_count: int) -> T.List[str]:
+    # Split the arguments of a function on the commas that are not inside a reference
+    args: T.List[str] = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(text):
+        if char in "({":
+            depth += 1
+        elif char in ")}":
+            depth -= 1
+        elif char == ',' and depth == 0 and (max_count == 0 or len(args) < max_count - 1):
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return args
+
+
+# Maximum number of arguments of each function, the commas after the last one belong to it (0 for any number)
+_FUNCTIONS = {
+    "subst": 3, "patsubst": 3, "strip": 1, "findstring": 2, "filter": 2, "filter-out": 2, "sort": 1,
+    "word": 2, "wordlist": 3, "words": 1, "firstword": 1, "lastword": 1, "dir": 1, "notdir": 1, "suffix": 1,
+    "basename": 1, "addsuffix": 2, "addprefix": 2, "join": 2, "wildcard": 1, "realpath": 1, "abspath": 1,
+    "if": 3, "or": 0, "and": 0, "foreach": 3, "call": 0, "value": 1, "origin": 1, "flavor": 1,
+    "info": 1, "warning": 1, "error": 1, "shell": 1, "eval": 1, "file": 2,
+}
+
+
+class Database:
+    def __init__(self, directory: str, engine: "MakeDatabaseEngine") -> None:
+        self.directory = directory
+        self.engine = engine
+        self.variables: Variables = {}
+        self.origins: T.Dict[str, str] = {}
+        self.rules: T.Dict[str, T.List[Rule]] = {}
+        self.double_colon: T.Set[str] = set()
+        self.mentioned: T.Set[str] = set()
+        self.pattern_rules: T.List[PatternRule] = []
+        self.dummy_patterns: T.List[str] = []
+        self.target_variables: T.Dict[str, T.List[T.Tuple[str, str, str]]] = {}
+        self.pattern_variables: T.List[T.Tuple[str, str, str, str]] = []
+        self.vpaths: T.List[T.Tuple[str, T.List[str]]] = []
+        self.phony: T.Set[str] = set()
+        self.suffixes: T.List[str] = []
+        self._expanding: T.Set[str] = set()
+        self._exists: T.Dict[str, bool] = {}
+        self._implicit: T.Dict[T.Tuple[str, int], T.Union[T.Tuple[PatternRule, str, T.List[str], T.List[str]], None]] = {}
+        self._pattern_suffixes: T.Dict[str, T.List[T.Tuple[int, int, PatternRule, str]]] = {}
+        self._done: T.Set[str] = set()
+
+    # Parsing of the output of `make -p`
+
+    def parse(self, text: str) -> None:
+        section = ""
+        paragraph: T.List[str] = []
+        for line in text.split('\n'):
+            if line.startswith("# ") and line[2:] in ("Variables", "Pattern-specific Variable Values", "Directories", "Implicit Rules", "Files", "VPATH Search Paths"):
+                self._parse_paragraph(section, paragraph)
+                paragraph = []
+                section = line[2:]
+            elif line == "" and section != "Variables":
+                self._parse_paragraph(section, paragraph)
+                paragraph = []
+            else:
+                paragraph.append(line)
+        self._parse_paragraph(section, paragraph)
+        for i, rule in enumerate(self.pattern_rules):
+            for j, pattern in enumerate(rule.targets):
+                self._pattern_suffixes.setdefault(pattern.split('%', 1)[-1], []).append((i, j, rule, pattern))
+        self.phony = set(self._prerequisites(".PHONY"))
+        self.suffixes = self._prerequisites(".SUFFIXES")
+        general_vpath = self.expand("$(VPATH)", [])
+        if general_vpath.strip() != "":
+            self.vpaths.append(("%", general_vpath.replace(':', ' ').split()))
+
+    def _prerequisites(self, target: str) -> T.List[str]:
+        return [prerequisite for rule in self.rules.get(target, []) for prerequisite in rule.prerequisites]
+
+    def _parse_paragraph(self, section: str, lines: T.List[str]) -> None:
+        if len(lines) == 0:
+            return
+        if section == "Variables":
+            self._parse_variables(lines)
+        elif section == "Pattern-specific Variable Values":
+            match = re.match(r"^(.+?) :$", lines[0])
+            for line in lines[1:]:
+                variable = _PATTERN_VARIABLE_RE.match(line)
+                if match is not None and variable is not None:
+                    # make prints them as `:=` with `$` escaped whatever their operator was, they are read as `+=`
+                    self.pattern_variables.append((match.group(1), variable.group("name"), "+", variable.group("value").replace("$$", "$")))
+        elif section == "Implicit Rules":
+            rule = self._parse_rule(lines)
+            if rule is not None:
+                targets, colons, prerequisites, order_only, recipe, _ = rule
+                if len(recipe) > 0:
+                    self.pattern_rules.append(PatternRule(targets, prerequisites, order_only, recipe, colons == "::"))
+                elif len(prerequisites) == 0:
+                    # Rules like `%.c:` keep the match-anything rules away from these files
+                    self.dummy_patterns.extend(targets)
+        elif section == "Files":
+            not_a_target = False
+            for line in lines:
+                variable = _TARGET_VARIABLE_RE.match(line)
+                if variable is not None:
+                    self.target_variables.setdefault(variable.group("target"), []).append((variable.group("name"), variable.group("op") or "", variable.group("value")))
+                elif line == "# Not a target:":
+                    not_a_target = True
+            rule = self._parse_rule([line for line in lines if _TARGET_VARIABLE_RE.match(line) is None])
+            if rule is not None:
+                targets, colons, prerequisites, order_only, recipe, stem = rule
+                for target in targets:
+                    self.mentioned.add(target)
+                    if not not_a_target:
+                        self.rules.setdefault(target, []).append(Rule(prerequisites, order_only, recipe, stem))
+                        if colons == "::":
+                            self.double_colon.add(target)
+                self.mentioned.update(prerequisites)
+        elif section == "VPATH Search Paths":
+            for line in lines:
+                if line.startswith("vpath "):
+                    _, pattern, directories = line.split(' ', 2)
+                    self.vpaths.append((pattern, directories.replace(':', ' ').split()))
+
+    def _parse_variables(self, lines: T.List[str]) -> None:
+        origin = ""
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if line.startswith("#"):
+                origin = line[2:]
+            elif line.startswith("define "):
+                name, _, op = line[len("define "):].partition(' ')
+                body = []
+                i += 1
+                while i < len(lines) and lines[i] != "endef":
+                    body.append(lines[i])
+                    i += 1
+                self.variables[name] = (op.strip() not in (":=", "::="), "\n".join(body))
+                self.origins[name] = origin
+            else:
+                match = _VARIABLE_RE.match(line)
+                if match is not None:
+                    self.variables[match.group("name")] = (match.group("op") == "", match.group("value"))
+                    self.origins[match.group("name")] = origin
+            i += 1
+
+    def _parse_rule(self, lines: T.List[str]) -> T.Union[T.Tuple[T.List[str], str, T.List[str], T.List[str], T.List[str], T.Union[str, None]], None]:
+        rule = None
+        recipe: T.List[str] = []
+        stem = None
+        for line in lines:
+            if line.startswith('\t'):
+                recipe.append(line[1:])
+            elif line.startswith('#'):
+                match = _STEM_RE.match(line)
+                if match is not None:
+                    stem = match.group("stem")
+            elif rule is None:
+                rule = _RULE_RE.match(line)
+        if rule is None:
+            return None
+        prerequisites, order_only = _split_prerequisites(rule.group("prerequisites"))
+        return rule.group("targets").split(), rule.group("colons"), prerequisites, order_only, recipe, stem
+
+    # Expansion of the variables and functions
+
+    def expand(self, text: str, scopes: T.List[Variables]) -> str:
+        if '$' not in text:
+            return text
+        output: T.List[str] = []
+        i = 0
+        while i < len(text):
+            j = text.find('$', i)
+            if j < 0 or j + 1 >= len(text):
+                output.append(text[i:] if j < 0 else text[i:j])
+                break
+            output.append(text[i:j])
+            char = text[j + 1]
+            if char in "({":
+                close = ')' if char == '(' else '}'
+                depth = 1
+                end = j + 2
+                while end < len(text):
+                    if text[end] == char:
+                        depth += 1
+                    elif text[end] == close:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    end += 1
+                if depth != 0:
+                    raise MakeDatabaseError(f"unterminated variable reference in `{text}` ({self.directory})")
+                output.append(self._reference(text[j + 2:end], scopes))
+                i = end + 1
+            else:
+                output.append('$' if char == '$' else self.variable(char, scopes))
+                i = j + 2
+        return "".join(output)
+
+    def _reference(self, body: str, scopes: T.List[Variables]) -> str:
+        name, separator, args = body.partition(' ')
+        if separator == "":
+            name, separator, args = body.partition('\t')
+        if separator != "" and name in _FUNCTIONS:
+            return self._function(name, _split_arguments(args.lstrip(" \t"), _FUNCTIONS[name]), scopes)
+
+        # $(name:from=to)
+        depth = 0
+        for i, char in enumerate(body):
+            if char in "({":
+                depth += 1
+            elif char in ")}":
+                depth -= 1
+            elif char == ':' and depth == 0 and '=' in body[i:]:
+                from_, _, to = self.expand(body[i + 1:], scopes).partition('=')
+                if '%' not in from_:
+                    from_, to = '%' + from_, '%' + to
+                value = self.variable(self.expand(body[:i], scopes), scopes)
+                return " ".join(_patsubst_word(from_, to, word) for word in value.split())
+        return self.variable(self.expand(body, scopes), scopes)
+
+    def lookup(self, name: str, scopes: T.List[Variables]) -> T.Union[T.Tuple[bool, str], None]:
+        for scope in scopes:
+            if name in scope:
+                return scope[name]
+        return self.variables.get(name)
+
+    def variable(self, name: str, scopes: T.List[Variables]) -> str:
+        if len(name) == 2 and name[1] in "DF" and name[0] in "@%<^+?|*":
+            words = self.variable(name[0], scopes).split()
+            if name[1] == "D":
+                return " ".join(os.path.dirname(word) or "." for word in words)
+            return " ".join(os.path.basename(word) for word in words)
+        found = self.lookup(name, scopes)
+        if found is None:
+            return ""
+        recursive, value = found
+        if not recursive:
+            return value
+        if name in self._expanding:
+            raise MakeDatabaseError(f"recursive variable `{name}` references itself (eventually) ({self.directory})")
+        self._expanding.add(name)
+        try:
+            return self.expand(value, scopes)
+        finally:
+            self._expanding.discard(name)
+
+    def _function(self, name: str, args: T.List[str], scopes: T.List[Variables]) -> str:
+        # The arguments of these ones are only expanded when they are needed
+        if name == "if":
+            if self.expand(args[0], scopes).strip() != "":
+                return self.expand(args[1], scopes) if len(args) > 1 else ""
+            return self.expand(args[2], scopes) if len(args) > 2 else ""
+        if name == "or":
+            for arg in args:
+                value = self.expand(arg, scopes).strip()
+                if value != "":
+                    return value
+            return ""
+        if name == "and":
+            value = ""
+            for arg in args:
+                value = self.expand(arg, scopes).strip()
+                if value == "":
+                    return ""
+            return value
+        if name == "foreach":
+            if len(args) < 3:
+                raise MakeDatabaseError(f"insufficient number of arguments to function `foreach` ({self.directory})")
+            variable = self.expand(args[0], scopes).strip()
+            return " ".join(self.expand(args[2], [{variable: (False, word)}, *scopes]) for word in self.expand(args[1], scopes).split())
+        if name == "value":
+            found = self.lookup(self.expand(args[0], scopes), scopes)
+            return "" if found is None else found[1]
+
+        values = [self.expand(arg, scopes) for arg in args]
+        words = values[-1].split()
+        if name == "call":
+            function = values[0].strip()
+            bindings: Variables = {str(i): (False, value) for i, value in enumerate(values)}
+            bindings["0"] = (False, function)
+            found = self.lookup(function, scopes)
+            if found is None:
+                return ""
+            return self.expand(found[1], [bindings, *scopes]) if found[0] else found[1]
+        if name == "subst":
+            return values[2].replace(values[0], values[1]) if len(values) == 3 and values[0] != "" else values[-1]
+        if name == "patsubst":
+            return " ".join(_patsubst_word(values[0], values[1], word) for word in words) if len(values) == 3 else ""
+        if name == "strip":
+            return " ".join(words)
+        if name == "findstring":
+            return values[0] if len(values) == 2 and values[0] in values[1] else ""
+        if name in ("filter", "filter-out"):
+            patterns = values[0].split()
+            keep = name == "filter"
+            return " ".join(word for word in words if any(_pattern_stem(pattern, word) is not None for pattern in patterns) == keep)
+        if name == "sort":
+            return " ".join(sorted(set(words)))
+        if name == "word":
+            index = int(values[0].strip())
+            return words[index - 1] if 0 < index <= len(words) else ""
+        if name == "wordlist":
+            start, end = int(values[0].strip()), int(values[1].strip())
+            return " ".join(words[max(start, 1) - 1:end])
+        if name == "words":
+            return str(len(words))
+        if name == "firstword":
+            return words[0] if len(words) > 0 else ""
+        if name == "lastword":
+            return words[-1] if len(words) > 0 else ""
+        if name == "dir":
+            return " ".join(word[:word.rfind('/') + 1] if '/' in word else "./" for word in words)
+        if name == "notdir":
+            return " ".join(word[word.rfind('/') + 1:] for word in words)
+        if name in ("suffix", "basename"):
+            results = []
+            for word in words:
+                dot = word.rfind('.')
+                has_suffix = dot > word.rfind('/')
+                if name == "suffix" and has_suffix:
+                    results.append(word[dot:])
+                elif name == "basename":
+                    results.append(word[:dot] if has_suffix else word)
+            return " ".join(results)
+        if name == "addsuffix":
+            return " ".join(word + values[0] for word in words)
+        if name == "addprefix":
+            return " ".join(values[0] + word for word in words)
+        if name == "join":
+            first, second = values[0].split(), values[1].split()
+            return " ".join(a + b for a, b in zip(first + [""] * (len(second) - len(first)), second + [""] * (len(first) - len(second))))
+        if name == "wildcard":
+            return " ".join(path for pattern in words for path in sorted(glob.glob(pattern, root_dir=self.directory)))
+        if name == "realpath":
+            return " ".join(os.path.realpath(os.path.join(self.directory, word)) for word in words if os.path.exists(os.path.join(self.directory, word)))
+        if name == "abspath":
+            return " ".join(os.path.normpath(os.path.join(self.directory, word)) for word in words)
+        if name == "origin":
+            name = values[0]
+            if any(name in scope for scope in scopes):
+                return "automatic" if len(name) == 1 else "file"
+            return self.origins.get(name, "undefined").split(' ')[0].strip("'") if name in self.variables else "undefined"
+        if name == "flavor":
+            found = self.lookup(values[0], scopes)
+            return "undefined" if found is None else "recursive" if found[0] else "simple"
+        if name in ("info", "warning"):
+            print(values[0], file=sys.stderr)
+            return ""
+        if name == "error":
+            raise MakeDatabaseError(f"{values[0]} ({self.directory})")
+        if name == "shell":
+            return self._shell(values[0])
+        # eval and file change the state of make, their effects at parse time are already in the database
+        return ""
+
+    def _shell(self, command: str) -> str:
+        try:
+            result = subprocess.run(command, shell=True, cwd=self.directory, stdout=subprocess.PIPE, timeout=self.engine.remaining())
+        except subprocess.TimeoutExpired:
+            raise self.engine.budget_exceeded(self.directory)
+        return result.stdout.decode(errors="replace").rstrip('\n').replace('\n', ' ')
+
+    # Walk of the rules, like `make -B`
+
+    def exists(self, name: str) -> bool:
+        if name not in self._exists:
+            self._exists[name] = os.path.exists(os.path.join(self.directory, name)) or self.resolve(name) != name
+        return self._exists[name]
+
+    def resolve(self, name: str) -> str:
+        # The path of a prerequisite found through VPATH or vpath
+        if name in self.rules or os.path.exists(os.path.join(self.directory, name)) or os.path.isabs(name):
+            return name
+        for pattern, directories in self.vpaths:
+            if _pattern_stem(pattern, name) is not None:
+                for directory in directories:
+                    if os.path.exists(os.path.join(self.directory, directory, name)):
+                        return os.path.join(directory, name)
+        return name
+
+    def implicit_rule(self, target: str, depth: int = 0) -> T.Union[T.Tuple[PatternRule, str, T.List[str], T.List[str]], None]:
+        # The pattern rule make would choose: all its prerequisites exist or are targets,
+        # then, if there is none, the ones whose prerequisites can be made by another pattern rule
+        key = (target, depth)
+        if key in self._implicit:
+            return self._implicit[key]
+        found = None
+        directory, filename = os.path.split(target)
+        # Only the patterns ending like the target can match it
+        candidates = sorted(candidate for suffix, patterns in self._pattern_suffixes.items() if target.endswith(suffix) for candidate in patterns)
+        specific: T.Union[bool, None] = None
+        for chaining in (False, True):
+            for _, _, rule, pattern in candidates:
+                if chaining and rule.terminal:
+                    continue
+                if pattern == "%" and not rule.terminal:
+                    if specific is None:
+                        specific = any(_pattern_stem(dummy, target) is not None for dummy in self.dummy_patterns)
+                    if depth > 0 or specific:
+                        continue
+                with_directory = '/' not in pattern and directory != ""
+                stem = _pattern_stem(pattern, filename if with_directory else target)
+                if stem is None:
+                    continue
+                # Without a slash in the pattern, the directory of the target is put back in front of the prerequisites
+                prefix = directory + "/" if with_directory else ""
+
+                def substitute(prerequisite: str) -> str:
+                    return prefix + prerequisite.replace('%', stem, 1) if '%' in prerequisite else prerequisite
+                prerequisites = [substitute(prerequisite) for prerequisite in rule.prerequisites]
+                if all(self.exists(prerequisite) or prerequisite in self.mentioned or (chaining and depth < 3 and self.implicit_rule(prerequisite, depth + 1) is not None) for prerequisite in prerequisites):
+                    found = (rule, prefix + stem, prerequisites, [substitute(prerequisite) for prerequisite in rule.order_only])
+                    break
+            if found is not None:
+                break
+        self._implicit[key] = found
+        return found
+
+    def _target_variables(self, target: str, inherited: Variables) -> Variables:
+        definitions = [(name, op, value) for pattern, name, op, value in self.pattern_variables if _pattern_stem(pattern, target) is not None]
+        definitions += self.target_variables.get(target, [])
+        if len(definitions) == 0:
+            return inherited
+        variables = dict(inherited)
+        for name, op, value in definitions:
+            if op == "":
+                variables[name] = (True, value)
+            elif op in (":", "::", "!"):
+                variables[name] = (False, value)
+            elif op == "?":
+                if self.lookup(name, [variables]) is None:
+                    variables[name] = (True, value)
+            else:
+                base = self.lookup(name, [variables])
+                if base is None:
+                    variables[name] = (True, value)
+                elif base[0]:
+                    variables[name] = (True, f"{base[1]} {value}" if base[1] != "" else value)
+                else:
+                    appended = self.expand(value, [variables])
+                    variables[name] = (False, f"{base[1]} {appended}" if base[1] != "" else appended)
+        return variables
+
+    def recipe_lines(self, goals: T.List[str]) -> T.Iterator[str]:
+        if len(goals) == 0:
+            default_goal = self.variable(".DEFAULT_GOAL", []).strip()
+            if default_goal == "":
+                raise MakeDatabaseError(f"no targets ({self.directory})")
+            goals = [default_goal]
+        # The Makefiles were already remade by make before it printed this database (see MakeDatabaseProcess),
+        # they and what they're made from (config.status, configure... for automake) are not part of the build
+        pending = self.variable("MAKEFILE_LIST", []).split()
+        while len(pending) > 0:
+            target = pending.pop()
+            if target not in self._done:
+                self._done.add(target)
+                pending.extend(self._prerequisites(target))
+        self._done.difference_update(goals)
+        for goal in goals:
+            yield from self._walk(goal, {}, [])
+
+    def _walk(self, target: str, inherited: Variables, stack: T.List[str]) -> T.Iterator[str]:
+        if target in self._done:
+            return
+        if target in stack:
+            # Like make, the dependency is dropped
+            print(f"make: Circular {stack[-1]} <- {target} dependency dropped.", file=sys.stderr)
+            return
+        self.engine.check_budget(self.directory)
+        stack.append(target)
+        variables = self._target_variables(target, inherited)
+        rules = self.rules.get(target, [])
+        if target in self.double_colon:
+            for rule in rules:
+                for prerequisite in rule.prerequisites + rule.order_only:
+                    yield from self._walk(prerequisite, variables, stack)
+                yield from self._recipe(target, rule.recipe, rule.prerequisites, rule.order_only, rule.stem, variables)
+        else:
+            recipe_rule = next((rule for rule in rules if len(rule.recipe) > 0), None)
+            ordered_rules = ([recipe_rule] if recipe_rule is not None else []) + [rule for rule in rules if rule is not recipe_rule]
+            prerequisites = [prerequisite for rule in ordered_rules for prerequisite in rule.prerequisites]
+            order_only = [prerequisite for rule in ordered_rules for prerequisite in rule.order_only]
+            recipe = recipe_rule.recipe if recipe_rule is not None else []
+            stem = recipe_rule.stem if recipe_rule is not None else None
+            if recipe_rule is None and target not in self.phony and target not in _SPECIAL_TARGETS:
+                implicit = self.implicit_rule(target)
+                if implicit is not None:
+                    pattern_rule, stem, pattern_prerequisites, pattern_order_only = implicit
+                    prerequisites = pattern_prerequisites + prerequisites
+                    order_only = pattern_order_only + order_only
+                    recipe = pattern_rule.recipe
+            for prerequisite in prerequisites + order_only:
+                yield from self._walk(prerequisite, variables, stack)
+            yield from self._recipe(target, recipe, prerequisites, order_only, stem, variables)
+        stack.pop()
+        self._done.add(target)
+
+    def _recipe(self, target: str, recipe: T.List[str], prerequisites: T.List[str], order_only: T.List[str], stem: T.Union[str, None], variables: Variables) -> T.Iterator[str]:
+        if len(recipe) == 0:
+            return
+        if stem is None:
+            stem = next((target[:-len(suffix)] for suffix in self.suffixes if target.endswith(suffix)), "")
+        resolved = [self.resolve(prerequisite) for prerequisite in prerequisites]
+        unique = list(dict.fromkeys(resolved))
+        automatic: Variables = {
+            "@": (False, target),
+            "<": (False, resolved[0] if len(resolved) > 0 else ""),
+            "^": (False, " ".join(unique)),
+            "+": (False, " ".join(resolved)),
+            "?": (False, " ".join(unique)),  # everything is out of date with -B
+            "|": (False, " ".join(dict.fromkeys(self.resolve(prerequisite) for prerequisite in order_only))),
+            "*": (False, stem),
+            "%": (False, ""),
+        }
+        # A line ending with a backslash continues on the next one, the shell removes the backslash-newline
+        lines: T.List[str] = []
+        continued = False
+        for line in recipe:
+            if continued:
+                lines[-1] = lines[-1][:-1] + line
+            else:
+                lines.append(line)
+            continued = line.endswith('\\') and (len(line) - len(line.rstrip('\\'))) % 2 == 1
+        for line in lines:
+            if _MAKE_REFERENCE_RE.search(line) is not None:
+                expanded = self.expand(line, [{"MAKE": (False, _MAKE_STUB)}, automatic, variables]).lstrip("@-+ \t")
+                if any(char in expanded for char in "$`;|(\n"):
+                    yield from self._make_calls(expanded, self.variable("MAKE", [automatic, variables]))
+                    continue
+            for command in self.expand(line, [automatic, variables]).split('\n'):
+                command = command.lstrip("@-+ \t")
+                if command != "":
+                    yield command
+
+    def _make_calls(self, script: str, make: str) -> T.Iterator[str]:
+        shell = self.variable("SHELL", []) or "/bin/sh"
+        try:
+            result = subprocess.run([shell, "-c", _MAKE_STUB_CODE + script], cwd=self.directory, stdout=subprocess.PIPE, timeout=self.engine.remaining())
+        except subprocess.TimeoutExpired:
+            raise self.engine.budget_exceeded(self.directory)
+        for line in result.stdout.decode(errors="replace").split('\n'):
+            if line.startswith(_EMPTY_GOAL + '\t'):
+                _, cwd, *args = line.split('\t')
+                command = " ".join(shlex.quote(arg) for arg in args)
+                if os.path.realpath(cwd) == os.path.realpath(self.directory):
+                    yield f"{make} {command}"
+                else:
+                    yield f"cd {shlex.quote(cwd)} && {make} {command}"
+
+
+def _make_arguments(command: str, cwd: str) -> T.Tuple[str, T.List[str], T.List[str]]:
+    # The directory where make runs (-C), the goals given to it and its other arguments
+    args = parse_command(command).args
+    directory = cwd
+    goals = []
+    others = [args[0]]
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        if arg in _OPTIONS_WITH_VALUE and i + 1 < len(args):
+            if arg in ("-C", "--directory"):
+                directory = os.path.join(directory, args[i + 1])
+            others.append(arg)
+            i += 1
+        elif arg.startswith("--directory="):
+            directory = os.path.join(directory, arg[len("--directory="):])
+        elif arg.startswith("-C") and len(arg) > 2:
+            directory = os.path.join(directory, arg[2:])
+        elif arg in ("-j", "--jobs", "-l", "--load-average") and i + 1 < len(args) and args[i + 1].replace('.', '').isdigit():
+            others.append(arg)
+            i += 1
+        elif not arg.startswith('-') and '=' not in arg:
+            goals.append(arg)
+            i += 1
+            continue
+        others.append(args[i])
+        i += 1
+    return directory, goals, others
+
+
+def last_database(output: str) -> str:
+    # When make remade some Makefiles, its output has the one of their recipes, the database read before remaking them,
+    # and the database of the Makefiles remade. Only the last one is complete and up to date.
+    end = output.rfind("\n# Finished Make data base")
+    if end < 0:
+        return output
+    start = output.rfind("\n# GNU Make ", 0, end)
+    return output[start + 1:end] if start >= 0 else output[:end]
+
+
+class MakeDatabaseProcess:
+    # A `make -p -q` started in the background, its database is parsed when the commands are needed.
+    # Used like makefile_dry_run.DryMakeProcess, its commands are relative to `directory` (where -C leads).
+    def __init__(self, engine: "MakeDatabaseEngine", command: str, cwd: str) -> None:
+        self.engine = engine
+        self.command = command
+        self.directory, self.goals, args = _make_arguments(command, cwd)
+        self.start_time = time.perf_counter()
+        self.finished = False
+        # Even with -q, make runs the recipes calling $(MAKE) of its goals, it's given an empty goal instead
+        self.process = subprocess.Popen(args + [f"--eval={_EMPTY_GOAL}:", _EMPTY_GOAL], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def lines(self) -> T.Iterator[str]:
+        try:
+            with profiling.phase("make"):
+                output, errors = self.process.communicate(timeout=self.engine.remaining())
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise self.engine.budget_exceeded(self.directory)
+        self._finish()
+        profiling.add_bytes_read("make", len(output))
+        # 1 only means that something is out of date
+        if self.process.returncode not in (0, 1):
+            # Most often a Makefile that make couldn't remake (a config.status older than configure...)
+            message = errors.decode(errors="replace").strip()
+            raise MakeDatabaseError(f"`{self.command}` failed with the status {self.process.returncode} in {self.directory}" + (f":\n{message}" if message != "" else ""))
+        sys.stderr.write(errors.decode(errors="replace"))
+
+        with profiling.phase("make_database"):
+            database = Database(self.directory, self.engine)
+            database.parse(last_database(output.decode(errors="replace")))
+        yield from profiling.iter_phase("make_database", database.recipe_lines(self.goals))
+
+    def _finish(self) -> None:
+        if not self.finished:
+            self.finished = True
+            profiling.add_subprocess("make", time.perf_counter() - self.start_time)
+
+    def kill(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        with profiling.phase("make"):
+            self.process.wait()
+        self._finish()
+
+
+class MakeDatabaseEngine:
+    # Everything run for the discovery has to finish within `time_budget` seconds
+    make_flags = "-p -q"
+
+    def __init__(self, time_budget: T.Union[float, None] = DEFAULT_TIME_BUDGET) -> None:
+        self.time_budget = time_budget
+        self.deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+    def remaining(self) -> T.Union[float, None]:
+        if self.deadline is None:
+            return None
+        return max(0., self.deadline - time.perf_counter())
+
+    def budget_exceeded(self, directory: str) -> MakeDatabaseError:
+        return MakeDatabaseError(f"the discovery of the build took more than its time budget of {self.time_budget:g}s (while in {directory})")
+
+    def check_budget(self, directory: str) -> None:
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise self.budget_exceeded(directory)
+
+    def start(self, command: str, cwd: str) -> MakeDatabaseProcess:
+        return MakeDatabaseProcess(self, command, cwd)
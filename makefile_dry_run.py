@@ -1,108 +1,323 @@
 import os
-import shlex
-import shutil
+import time
 import subprocess
+import collections
 import typing as T
 
-make_fullpath = shutil.which("make")
-cmake_fullpath = shutil.which("cmake")
-
-_cache_which = {}
-def sh_which_cache(name: str) -> T.Union[str, None]:
-    if name not in _cache_which:
-        _cache_which[name] = shutil.which(name)
-    return _cache_which[name]
-
-def consume_command(command: str, i: int, stop_at_space: bool = False) -> int:
-    in_string = 0
-    escaped = False
-    while i+1 < len(command) and (in_string or escaped or ((command[i] != '&' or command[i+1] != '&') and (not stop_at_space or command[i] != ' ' and command[i] != '\t'))):
-        if not escaped and command[i] == '"' and in_string != 2:
-            if in_string == 0:
-                in_string = 1
-            else:
-                in_string = 0
-        elif not escaped and command[i] == "'" and in_string != 1:
-            if in_string == 0:
-                in_string = 2
-            else:
-                in_string = 0
-
-        if command[i] == '\\':
-            escaped = True
-        else:
-            escaped = False
-
-        i += 1
+from shell_tokenizer import Command, tokenize, parse_command
 
-    if i+1 == len(command):
-        i += 1
-    return i
+from toolchain import binary_kind
+from dry_run_cache import Closure, DryRunCache, DryRunCacheWriter, makefiles_of
+from make_database import MakeDatabaseEngine, MakeDatabaseProcess
+import profiling
 
-def split_commands_by_cwd(command: str, dir: str = ".") -> T.List[T.Tuple[str, str]]:
+def split_commands_by_cwd(command: str, dir: str = ".") -> T.List[T.Tuple[str, Command]]:
     commands = []
-    i = 0
-    while i < len(command):
-        s = i
-        i = consume_command(command, i)
-
-        parsed_command = shlex.split(command[s: i])
-        if len(parsed_command) == 0:
+    with profiling.phase("tokenize"):
+        cmds = tokenize(command)
+    for cmd in cmds:
+        if len(cmd.args) == 0:
             continue
 
-        if parsed_command[0] == "cd":
-            if len(parsed_command) < 2:
+        if cmd.args[0] == "cd":
+            if len(cmd.args) < 2:
                 dir = os.path.expanduser('~/')
             else:
-                dir = os.path.join(dir, parsed_command[1])
+                dir = os.path.join(dir, cmd.args[1])
         else:
-            commands.append((dir, command[s: i]))
-
-        while i < len(command) and command[i] == '&':
-            i += 1
-        while i < len(command) and (command[i] == ' ' or command[i] == '\t'):
-            i += 1
+            commands.append((dir, cmd))
     return commands
 
-def neutralize_make(command: str) -> T.Tuple[bool, bool, str]:
-    splitted_cmd = shlex.split(command)
+def neutralize_make(command: str, make_flags: str = "-n -B") -> T.Tuple[bool, bool, str]:
+    parsed_command = parse_command(command)
+    splitted_cmd = parsed_command.args
     binary = splitted_cmd[0]
-    if sh_which_cache(binary) == make_fullpath:
-        return False, True, f"{binary} -n -B {command[consume_command(command, 0, True):]}"
-    if sh_which_cache(binary) == cmake_fullpath:
+    kind = binary_kind(binary)
+    if kind == "make":
+        return False, True, f"{binary} {make_flags} {command[parsed_command.binary_end:]}"
+    if kind == "cmake":
         if len(splitted_cmd) >= 4 and splitted_cmd[1] == "-E" and splitted_cmd[2] == "cmake_link_script":
             return True, False, splitted_cmd[3]
         return True, False, ""
     return False, False, command
 
 
-def list_commands(commands: T.List[str], dir: str = ".") -> T.List[T.Tuple[str, str]]:
-    final_commands = []
-    for command in commands:
-        for cwd, cmd in split_commands_by_cwd(command, dir):
-            cmake_found, make_found, neutralized_command = neutralize_make(cmd)
+class DryMakeProcess:
+    # A `make -n -B` started in the background, its output is read line by line when it's needed
+    def __init__(self, command: str, cwd: str) -> None:
+        self.command = command
+        self.directory = cwd
+        self.start_time = time.perf_counter()
+        self.finished = False
+        self.process = subprocess.Popen(command, shell=True, cwd=cwd, stdout=subprocess.PIPE)
+
+    def lines(self) -> T.Iterator[str]:
+        stdout = self.process.stdout
+        assert stdout is not None
+        completed = False
+        try:
+            while True:
+                with profiling.phase("make"):
+                    line = stdout.readline()
+                if len(line) == 0:
+                    break
+                profiling.add_bytes_read("make", len(line))
+                yield line.decode().rstrip('\n')
+            completed = True
+        finally:
+            stdout.close()
+            if not completed:
+                # The output was abandoned before its end
+                self.kill()
+        if self.wait() != 0:
+            raise subprocess.CalledProcessError(self.process.returncode, self.command)
+
+    def wait(self) -> int:
+        with profiling.phase("make"):
+            returncode = self.process.wait()
+        if not self.finished:
+            self.finished = True
+            profiling.add_subprocess("make", time.perf_counter() - self.start_time)
+        return returncode
+
+    def kill(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.wait()
+
+
+class MakeRecursionError(Exception):
+    pass
+
+
+class MakeSlots:
+    # The sub-makes started in advance by all the levels of a project, at most `jobs` of them run at the same time.
+    # The ones that are done don't count anymore, nor the sub-make being read on each level (a serial expansion runs it too).
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.running: T.List[T.Union[DryMakeProcess, MakeDatabaseProcess]] = []
+
+    def free(self) -> bool:
+        self.running = [process for process in self.running if process.process.poll() is None]
+        return len(self.running) < self.jobs
+
+    def add(self, process: T.Union[DryMakeProcess, MakeDatabaseProcess]) -> None:
+        self.running.append(process)
+
+    def release(self, process: T.Union[DryMakeProcess, MakeDatabaseProcess]) -> None:
+        if process in self.running:
+            self.running.remove(process)
+
+
+def start_make(neutralized_command: str, cwd: str, engine: T.Union[MakeDatabaseEngine, None]) -> T.Union[DryMakeProcess, MakeDatabaseProcess]:
+    if engine is None:
+        return DryMakeProcess(neutralized_command, cwd)
+    return engine.start(neutralized_command, cwd)
+
+
+class DryRunMemo:
+    # Per-run memo of the sub-make dry runs and of the cmake link scripts.
+    # CMake Makefiles call the same build.make and link.txt from several parent rules,
+    # their expansion is replayed from here instead of being computed again.
+    # Expansions longer than `max_replay_size` are not kept, nor the ones after `max_replay_total` entries, to keep the memory bounded.
+    # With a `cache`, the sub-make expansions are also kept on disk for the next runs.
+    def __init__(self, max_replay_size: int = 100000, cache: T.Union[DryRunCache, None] = None, max_replay_total: T.Union[int, None] = None) -> None:
+        self.max_replay_size = max_replay_size
+        self.max_replay_total = max_replay_total
+        self.replay_total = 0
+        self.expansions: T.Dict[T.Tuple[str, ...], T.List[T.Tuple[str, Command]]] = {}
+        self.hits = 0
+        self.cache = cache
+        self.cache_hits = 0
+        # The Makefiles each expansion depends on, its own ones and the ones of the nested expansions
+        self.closures: T.Dict[T.Tuple[str, ...], Closure] = {}
+        self._closure_stack: T.List[Closure] = []
+
+    def make_key(self, cwd: str, neutralized_command: str) -> T.Tuple[str, str]:
+        return (os.path.realpath(cwd), neutralized_command)
+
+    def link_script_key(self, path: str) -> T.Tuple[str, str, str]:
+        return ("cmake_link_script", os.path.realpath(path), str(os.stat(path).st_mtime_ns))
+
+    def make_files(self, cwd: str, neutralized_command: str) -> T.Union[T.List[str], None]:
+        if self.cache is None:
+            return None
+        return makefiles_of(neutralized_command, cwd)
+
+    def is_cached(self, key: T.Tuple[str, ...]) -> bool:
+        return self.cache is not None and self.cache.load(key) is not None
+
+    def _merge_closure(self, closure: Closure) -> None:
+        if len(self._closure_stack) == 0 or self._closure_stack[-1] is None:
+            return
+        if closure is None:
+            self._closure_stack[-1] = None
+        else:
+            self._closure_stack[-1].update(closure)
+
+    def replay_or_record(self, key: T.Tuple[str, ...], expand: T.Callable[[], T.Iterator[T.Tuple[str, Command]]], makefiles: T.Union[T.List[str], None] = None, cacheable: bool = False) -> T.Iterator[T.Tuple[str, Command]]:
+        if key in self.expansions:
+            self.hits += 1
+            profiling.count("dry_run_memo_hits")
+            self._merge_closure(self.closures.get(key))
+            yield from self.expansions[key]
+            return
+
+        entries: T.Union[T.Iterator[T.Tuple[str, Command]], None] = None
+        writer: T.Union[DryRunCacheWriter, None] = None
+        # The closure of this expansion, known once it's done (with a cache only)
+        closure: Closure = None
+        if self.cache is not None:
+            loaded = self.cache.load(key) if cacheable else None
+            if loaded is not None:
+                self.cache_hits += 1
+                profiling.count("dry_run_cache_hits")
+                closure, entries = loaded
+                self._closure_stack.append(closure)
+            else:
+                self._closure_stack.append(None if makefiles is None else self.cache.hashes(makefiles))
+                if cacheable and makefiles is not None:
+                    writer = self.cache.writer(key)
+        if entries is None:
+            entries = expand()
+
+        recorded: T.Union[T.List[T.Tuple[str, Command]], None] = []
+        try:
+            for entry in entries:
+                if recorded is not None:
+                    recorded.append(entry)
+                    if len(recorded) > self.max_replay_size:
+                        recorded = None
+                if writer is not None:
+                    writer.write(*entry)
+                yield entry
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            if self.cache is not None:
+                closure = self._closure_stack.pop()
+        if self.cache is not None:
+            if writer is not None:
+                if closure is not None:
+                    writer.commit(closure)
+                else:
+                    writer.abort()
+            self.closures[key] = closure
+            self._merge_closure(closure)
+        if recorded is not None and (self.max_replay_total is None or self.replay_total + len(recorded) <= self.max_replay_total):
+            self.replay_total += len(recorded)
+            self.expansions[key] = recorded
+
+
+# Number of commands read in advance in each make output, while looking for sub-makes to start
+MAX_LOOKAHEAD = 4096
+
+
+def _iter_level(lines: T.Iterable[str], dir: str, slots: MakeSlots, memo: DryRunMemo, engine: T.Union[MakeDatabaseEngine, None] = None, parents: T.Tuple[T.Tuple[str, ...], ...] = ()) -> T.Iterator[T.Tuple[str, Command]]:
+    # The commands are read a little in advance so that the sub-makes run while there are free `slots`,
+    # but they are yielded in the exact order they were printed.
+    # `parents` are the keys of the sub-makes being expanded, a sub-make calling one of them would never end.
+    def parse() -> T.Iterator[T.Tuple[str, Command, bool, bool, str]]:
+        for command in lines:
+            for cwd, cmd in split_commands_by_cwd(command, dir):
+                cmake_found, make_found, neutralized_command = neutralize_make(cmd) if engine is None else neutralize_make(cmd, engine.make_flags)
+                yield cwd, cmd, cmake_found, make_found, neutralized_command
+
+    source = parse()
+    lookahead: T.Deque[T.Tuple[str, Command, bool, bool, str, T.Union[DryMakeProcess, MakeDatabaseProcess, None]]] = collections.deque()
+    started: T.Dict[T.Tuple[str, ...], T.Union[DryMakeProcess, MakeDatabaseProcess]] = {}
+    source_exhausted = False
+    held: T.Union[T.Tuple[str, Command], None] = None  # last command, kept to merge a ranlib into it
+    try:
+        while True:
+            # A level always reads its next command, the outer levels may hold all the slots
+            while not source_exhausted and (len(lookahead) == 0 or slots.free()) and len(lookahead) < MAX_LOOKAHEAD:
+                try:
+                    cwd, cmd, cmake_found, make_found, neutralized_command = next(source)
+                except StopIteration:
+                    source_exhausted = True
+                    break
+                process = None
+                if make_found:
+                    key = memo.make_key(cwd, neutralized_command)
+                    if key not in memo.expansions and key not in started and key not in parents and not memo.is_cached(key) and slots.free():
+                        process = start_make(neutralized_command, cwd, engine)
+                        started[key] = process
+                        slots.add(process)
+                lookahead.append((cwd, cmd, cmake_found, make_found, neutralized_command, process))
+            if len(lookahead) == 0:
+                break
+
+            cwd, cmd, cmake_found, make_found, neutralized_command, process = lookahead.popleft()
+            expansion: T.Union[T.Iterator[T.Tuple[str, Command]], None] = None
             if make_found:
-                final_commands.extend(list_commands(subprocess.check_output(neutralized_command, shell=True, cwd=cwd).decode().split('\n'), cwd))
+                key = memo.make_key(cwd, neutralized_command)
+                if key in parents:
+                    chain = [f"`{command}` in {directory}" for directory, command in parents[parents.index(key):] + (key,)]
+                    raise MakeRecursionError("make calls itself recursively: " + " -> ".join(chain))
+                if process is not None:
+                    del started[key]
+                    slots.release(process)
+                    if key in memo.expansions:
+                        # A nested level already ran the same sub-make
+                        process.kill()
+                elif key not in memo.expansions and not memo.is_cached(key):
+                    # Its first occurrence was too big to be replayed, run it again
+                    process = start_make(neutralized_command, cwd, engine)
+
+                def expand_make(process: T.Union[DryMakeProcess, MakeDatabaseProcess, None] = process, key: T.Tuple[str, str] = key) -> T.Iterator[T.Tuple[str, Command]]:
+                    # Only called when the expansion is neither replayed nor cached, the process was started above
+                    assert process is not None
+                    return _iter_level(process.lines(), process.directory, slots, memo, engine, parents + (key,))
+                expansion = memo.replay_or_record(key, expand_make, memo.make_files(cwd, neutralized_command), cacheable=True)
             elif cmake_found:
                 if len(neutralized_command) > 0:
-                    file = open(os.path.join(cwd, neutralized_command), "r")
-                    cmds = file.read().split('\n')
-                    file.close()
-                    for i in range(len(cmds)):
-                        cmds[i] = cmds[i].strip()
-                    final_commands.extend(list_commands(cmds, cwd))
+                    path = os.path.join(cwd, neutralized_command)
+
+                    def read_link_script() -> T.Iterator[T.Tuple[str, Command]]:
+                        file = open(path, "r")
+                        cmds = file.read().split('\n')
+                        file.close()
+                        for i in range(len(cmds)):
+                            cmds[i] = cmds[i].strip()
+                        return _iter_level(cmds, cwd, slots, memo, engine, parents)
+                    # Not kept on disk, but the expansions that read it depend on it
+                    expansion = memo.replay_or_record(memo.link_script_key(path), read_link_script, [path])
             else:
-                splitted = shlex.split(cmd)
-                cmd_fullpath = None
-                if len(splitted) > 0:
-                    cmd_fullpath = sh_which_cache(splitted[0])
-                if cmd_fullpath is not None and cmd_fullpath.endswith(("-ranlib", "/ranlib")) and len(final_commands) > 0:
-                    splitted = shlex.split(final_commands[-1][1])
-                    cmd_fullpath = None
-                    if len(splitted) > 0:
-                        cmd_fullpath = sh_which_cache(splitted[0])
-                    if cmd_fullpath is not None and cmd_fullpath.endswith(("-ar", "/ar")) and "ar -s " not in final_commands[-1][1]:
-                        final_commands[-1] = (final_commands[-1][0], final_commands[-1][1].replace("ar ", "ar -s "))
+                if len(cmd.args) > 0 and binary_kind(cmd.args[0]) == "ranlib" and held is not None:
+                    splitted = parse_command(held[1]).args
+                    if len(splitted) > 0 and binary_kind(splitted[0]) == "archiver" and "ar -s " not in held[1]:
+                        held = (held[0], parse_command(held[1].replace("ar ", "ar -s ")))
                         continue  # skip this ranlib command, we applied it to the ar command above
-                final_commands.append((cwd, cmd))
-    return final_commands
+                if held is not None:
+                    yield held
+                held = (cwd, cmd)
+
+            if expansion is not None:
+                for entry in expansion:
+                    if held is not None:
+                        yield held
+                    held = entry
+        if held is not None:
+            yield held
+    finally:
+        for _, _, _, _, _, process in lookahead:
+            if process is not None:
+                process.kill()
+                slots.release(process)
+
+
+def iter_commands(commands: T.Iterable[str], dir: str = ".", jobs: int = 1, memo: T.Union[DryRunMemo, None] = None, engine: T.Union[MakeDatabaseEngine, None] = None) -> T.Iterator[T.Tuple[str, Command]]:
+    # Stream the (cwd, command) entries while make is still printing them.
+    # Up to `jobs` dry runs of make are started in advance, whatever the level of the sub-makes,
+    # the entries are in the same order as a serial expansion.
+    # With an `engine`, the commands come from the database of make instead of its dry run (see make_database).
+    if memo is None:
+        memo = DryRunMemo()
+    return _iter_level(commands, dir, MakeSlots(max(1, jobs)), memo, engine)
+
+
+def list_commands(commands: T.List[str], dir: str = ".", jobs: int = 1, memo: T.Union[DryRunMemo, None] = None, engine: T.Union[MakeDatabaseEngine, None] = None) -> T.List[T.Tuple[str, Command]]:
+    return list(iter_commands(commands, dir, jobs, memo, engine))
@@ -0,0 +1,169 @@
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import typing as T
+
+# Per-phase measures of a translation, enabled with `main.py --profile`.
+# The phases are nested (the dry run of make happens while the commands are grouped),
+# the time and memory of a phase don't include the ones of the phases running inside it.
+# The counters count events that don't belong to a phase, like the replays of the dry run memo.
+
+PHASES = ["make", "make_database", "tokenize", "toolchain", "dry_run", "load_commands", "grouping", "glob_inference", "instructions", "emit"]
+
+COUNTERS = ["dry_run_memo_hits", "dry_run_cache_hits"]
+
+
+class PhaseStats:
+    __slots__ = ("wall_time", "calls", "subprocesses", "subprocess_time", "bytes_read", "peak_memory")
+
+    def __init__(self) -> None:
+        self.wall_time = 0.
+        self.calls = 0
+        self.subprocesses = 0
+        self.subprocess_time = 0.
+        self.bytes_read = 0
+        self.peak_memory = 0
+
+    def to_dict(self) -> T.Dict[str, T.Union[int, float]]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+enabled = False
+stats: T.Dict[str, PhaseStats] = {}
+counters: T.Dict[str, int] = {}
+_stack: T.List[str] = []
+_last_switch = 0.
+_start = 0.
+_end = 0.
+
+
+def _switch() -> None:
+    # Everything since the last switch is charged to the phase at the top of the stack
+    global _last_switch
+    now = time.perf_counter()
+    if len(_stack) > 0:
+        phase_stats = stats[_stack[-1]]
+        phase_stats.wall_time += now - _last_switch
+        peak = tracemalloc.get_traced_memory()[1]
+        if peak > phase_stats.peak_memory:
+            phase_stats.peak_memory = peak
+    tracemalloc.reset_peak()
+    _last_switch = now
+
+
+class _Phase:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        _switch()
+        _stack.append(self.name)
+        stats[self.name].calls += 1
+
+    def __exit__(self, *args: T.Any) -> None:
+        _switch()
+        _stack.pop()
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args: T.Any) -> None:
+        pass
+
+
+_no_phase = _NoPhase()
+_phases = {name: _Phase(name) for name in PHASES}
+
+
+def phase(name: str) -> T.Union[_Phase, _NoPhase]:
+    # Cheap enough to be used on every line when the profiling is disabled
+    if not enabled:
+        return _no_phase
+    return _phases[name]
+
+
+def iter_phase(name: str, iterator: T.Iterable[T.Any]) -> T.Iterator[T.Any]:
+    # Charge the time spent to produce each element of a stream to `name`
+    if not enabled:
+        yield from iterator
+        return
+    iterator = iter(iterator)
+    while True:
+        with phase(name):
+            try:
+                element = next(iterator)
+            except StopIteration:
+                return
+        yield element
+
+
+def add_subprocess(name: str, seconds: float) -> None:
+    if enabled:
+        stats[name].subprocesses += 1
+        stats[name].subprocess_time += seconds
+
+
+def add_bytes_read(name: str, count: int) -> None:
+    if enabled:
+        stats[name].bytes_read += count
+
+
+def count(name: str, increment: int = 1) -> None:
+    if enabled:
+        counters[name] += increment
+
+
+def start() -> None:
+    global enabled, _start, _last_switch
+    enabled = True
+    stats.clear()
+    stats.update({name: PhaseStats() for name in PHASES})
+    counters.clear()
+    counters.update({name: 0 for name in COUNTERS})
+    _stack.clear()
+    tracemalloc.start()
+    _start = _last_switch = time.perf_counter()
+
+
+def stop() -> None:
+    global enabled, _end
+    _switch()
+    _end = time.perf_counter()
+    enabled = False
+    tracemalloc.stop()
+
+
+def report() -> T.Dict[str, T.Any]:
+    return {
+        "python": platform.python_version(),
+        "argv": sys.argv,
+        "wall_time": _end - _start,
+        "phases": {name: stats[name].to_dict() for name in PHASES},
+        "counters": {name: counters[name] for name in COUNTERS},
+    }
+
+
+def save_json(path: str) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report(), file, indent=2)
+        file.write("\n")
+
+
+def print_report(file: T.TextIO = sys.stderr) -> None:
+    print(f"{'phase':<16}{'time (s)':>10}{'calls':>10}{'processes':>11}{'proc. time':>12}{'bytes read':>12}{'peak mem.':>12}", file=file)
+    for name in PHASES:
+        s = stats[name]
+        if s.calls == 0:
+            continue
+        print(f"{name:<16}{s.wall_time:>10.3f}{s.calls:>10}{s.subprocesses:>11}{s.subprocess_time:>12.3f}{s.bytes_read:>12}{s.peak_memory / 2**20:>10.1f}Mi", file=file)
+    print(f"{'total':<16}{_end - _start:>10.3f}  (the time includes the overhead of tracemalloc)", file=file)
+    for name in COUNTERS:
+        print(f"{name:<24}{counters[name]:>10}", file=file)
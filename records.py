@@ -0,0 +1,66 @@
+import sys
+import typing as T
+
+# Compact records used by create_compilation_groups and create_instructions.
+# Big projects have hundreds of thousands of them, so they use __slots__ instead of lists and dicts,
+# and the file paths and flags are interned so that each of them is only stored once.
+
+OperationType = T.Literal["compile", "pch", "link", "shared_link", "archive", "command"]
+
+
+def intern_strings(strings: T.Iterable[str]) -> T.List[str]:
+    return [sys.intern(string) for string in strings]
+
+
+def intern_args(args: T.Iterable[T.Union[str, T.Tuple[str, ...]]]) -> T.List[T.Union[str, T.Tuple[str, ...]]]:
+    return [sys.intern(arg) if isinstance(arg, str) else tuple(intern_strings(arg)) for arg in args]
+
+
+class ToolCommand:
+    # A compiler or archiver command
+    __slots__ = ("operation_type", "defines", "includedirs", "args", "inputfiles", "outputfile")
+
+    def __init__(self, operation_type: OperationType, defines: T.List[str], includedirs: T.List[str], args: T.Sequence[T.Union[str, T.Tuple[str, ...]]], inputfiles: T.List[str], outputfile: T.Union[str, None]) -> None:
+        self.operation_type = operation_type
+        self.defines = intern_strings(defines)
+        self.includedirs = intern_strings(includedirs)
+        self.args = intern_args(args)
+        self.inputfiles = intern_strings(inputfiles)
+        self.outputfile = None if outputfile is None else sys.intern(outputfile)
+
+
+class ShellCommand:
+    # Any other command, it will be translated to a powermake.run_command
+    __slots__ = ("operation_type", "command", "cwd")
+
+    def __init__(self, command: str, cwd: str) -> None:
+        self.operation_type: OperationType = "command"
+        self.command = command
+        self.cwd = cwd
+
+
+class GroupFile:
+    __slots__ = ("dependencies", "output")
+
+    def __init__(self, dependencies: T.List[str], output: str) -> None:
+        self.dependencies = dependencies
+        self.output = output
+
+
+class Group:
+    # Commands that can be translated to a single powermake call.
+    # The consecutive groups of the same `stage` don't depend on each other, they can run at the same time.
+    __slots__ = ("operation_type", "defines", "includedirs", "args", "files", "command", "command_cwd", "stage")
+
+    def __init__(self, operation_type: OperationType, defines: T.List[str], includedirs: T.List[str], args: T.List[T.Union[str, T.Tuple[str, ...]]], files: T.List[GroupFile], command: T.Union[str, None] = None, command_cwd: T.Union[str, None] = None, stage: int = 0) -> None:
+        self.operation_type = operation_type
+        self.defines = defines
+        self.includedirs = includedirs
+        self.args = args
+        self.files = files
+        self.command = command
+        self.command_cwd = command_cwd
+        self.stage = stage
+
+    def with_files(self, files: T.List[GroupFile]) -> "Group":
+        return Group(self.operation_type, self.defines, self.includedirs, self.args, files, self.command, self.command_cwd, self.stage)
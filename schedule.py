@@ -0,0 +1,167 @@
+import os
+import re
+import heapq
+import math
+import typing as T
+
+from records import OperationType, ToolCommand, ShellCommand, Group, GroupFile
+
+# Order of the groups in the generated PowerMake.
+# The commands make printed are put in a graph: a command depends on the commands producing its inputs,
+# and the links also depend on the libraries they use through -l.
+# The custom commands and the precompiled headers are barriers, their inputs and outputs are unknown.
+# Each command is placed at the first stage where all its dependencies are done, the compile commands of a stage
+# are gathered in one group per set of flags, and the groups of a stage run at the same time (see PARALLEL_CODE).
+# Inside a stage, the groups at the head of the longest chain of stages (the critical path) come first.
+# The spill store (--max-memory) places the commands with the same rules, in SQL.
+
+
+_LIBRARY_RE = re.compile(r"^lib(.+?)\.(?:a|so(?:\.[0-9]+)*|dylib)$")
+
+
+def is_barrier(operation_type: OperationType) -> bool:
+    return operation_type in ("command", "pch")
+
+
+def library_names(output: str) -> T.List[str]:
+    # The -l arguments a link can use to take the library `output`
+    filename = os.path.basename(output)
+    match = _LIBRARY_RE.match(filename)
+    return ["-l:" + filename] if match is None else ["-l:" + filename, "-l" + match.group(1)]
+
+
+def linked_libraries(operation_type: OperationType, args: T.Iterable[T.Union[str, T.Tuple[str, ...]]]) -> T.List[str]:
+    if operation_type not in ("link", "shared_link"):
+        return []
+    return [arg for arg in args if isinstance(arg, str) and arg.startswith("-l")]
+
+
+def _schedule_segment(commands: T.List[ToolCommand], first_stage: int) -> T.Tuple[T.List[Group], int]:
+    # The commands between two barriers, the stages start at `first_stage`, the next free stage is returned
+    producers: T.Dict[str, int] = {}
+    libraries: T.Dict[str, int] = {}  # -lNAME and -l:FILE of the libraries made so far
+    dependencies: T.List[T.List[int]] = []
+    levels: T.List[int] = []
+    for i, command in enumerate(commands):
+        assert command.outputfile is not None
+        deps = [producers[file] for file in map(os.path.normpath, command.inputfiles) if file in producers]
+        deps.extend(libraries[name] for name in linked_libraries(command.operation_type, command.args) if name in libraries)
+        dependencies.append(deps)
+        levels.append(1 + max(levels[dep] for dep in deps) if len(deps) > 0 else 0)
+        producers[os.path.normpath(command.outputfile)] = i
+        if command.operation_type != "compile":
+            for name in library_names(command.outputfile):
+                libraries[name] = i
+
+    # Length of the longest chain of commands starting at each command
+    heights = [1] * len(commands)
+    for i in range(len(commands) - 1, -1, -1):
+        for dep in dependencies[i]:
+            heights[dep] = max(heights[dep], heights[i] + 1)
+
+    groups: T.List[Group] = []
+    priorities: T.List[T.Tuple[int, int, int]] = []
+    compile_groups: T.Dict[T.Tuple[int, T.Tuple[T.Any, ...], T.Tuple[T.Any, ...], T.Tuple[T.Any, ...]], int] = {}
+    for i, command in enumerate(commands):
+        assert command.outputfile is not None
+        file = GroupFile(command.inputfiles, command.outputfile)
+        if command.operation_type == "compile":
+            key = (levels[i], tuple(command.defines), tuple(command.includedirs), tuple(command.args))
+            if key in compile_groups:
+                index = compile_groups[key]
+                groups[index].files.append(file)
+                priorities[index] = (min(priorities[index][0], -heights[i]), priorities[index][1] - 1, priorities[index][2])
+                continue
+            compile_groups[key] = len(groups)
+        groups.append(Group(command.operation_type, command.defines, command.includedirs, command.args, [file], stage=first_stage + levels[i]))
+        priorities.append((-heights[i], -1, i))
+
+    order = sorted(range(len(groups)), key=lambda index: (groups[index].stage, priorities[index]))
+    return [groups[index] for index in order], first_stage + (max(levels) + 1 if len(levels) > 0 else 0)
+
+
+def schedule_commands(commands: T.List[T.Union[ToolCommand, ShellCommand]]) -> T.List[Group]:
+    groups: T.List[Group] = []
+    segment: T.List[ToolCommand] = []
+    stage = 0
+    for command in commands + [None]:
+        if command is not None and not is_barrier(command.operation_type):
+            assert isinstance(command, ToolCommand)
+            segment.append(command)
+            continue
+        segment_groups, stage = _schedule_segment(segment, stage)
+        groups.extend(segment_groups)
+        segment = []
+        if isinstance(command, ShellCommand):
+            groups.append(Group("command", [], [], [], [], command.command, command.cwd, stage))
+            stage += 1
+        elif command is not None:
+            assert command.outputfile is not None
+            groups.append(Group(command.operation_type, command.defines, command.includedirs, command.args, [GroupFile(command.inputfiles, command.outputfile)], stage=stage))
+            stage += 1
+    return groups
+
+
+# A stage of a huge project is cut in parts of about this many paths (the outputs and their inputs), one after the other,
+# so that it's never entirely in memory (--max-memory) and its run_in_parallel stays readable. A part still keeps all the jobs busy.
+MAX_STAGE_PATHS = 16384
+
+
+def iter_stages(groups: T.Iterable[Group]) -> T.Iterator[T.List[Group]]:
+    # The consecutive groups of the same stage, the custom commands and the precompiled headers are always alone
+    stage: T.List[Group] = []
+    paths = 0
+    for group in groups:
+        group_paths = sum(1 + len(file.dependencies) for file in group.files)
+        if len(stage) > 0 and (group.stage != stage[0].stage or is_barrier(group.operation_type) or is_barrier(stage[0].operation_type) or paths + group_paths > MAX_STAGE_PATHS):
+            yield stage
+            stage = []
+            paths = 0
+        stage.append(group)
+        paths += group_paths
+    if len(stage) > 0:
+        yield stage
+
+
+# Estimation of the parallelism: every command takes one step, a step runs `jobs` commands at most
+
+def make_steps(groups: T.List[Group], jobs: int) -> int:
+    # make -j runs a command as soon as the commands producing its inputs are done, the ready ones in the order of the groups
+    producers: T.Dict[str, int] = {}
+    dependencies: T.List[T.Set[int]] = []
+    for group in groups:
+        for file in group.files:
+            output = os.path.normpath(file.output)
+            if output in producers:
+                continue
+            producers[output] = len(dependencies)
+            dependencies.append({producers[dependency] for dependency in map(os.path.normpath, file.dependencies) if dependency in producers})
+
+    dependents: T.List[T.List[int]] = [[] for _ in dependencies]
+    for i, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(i)
+    waiting = [len(deps) for deps in dependencies]
+    ready = [i for i in range(len(dependencies)) if waiting[i] == 0]
+    steps = 0
+    while len(ready) > 0:
+        running = [heapq.heappop(ready) for _ in range(min(jobs, len(ready)))]
+        for i in running:
+            for dependent in dependents[i]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+        steps += 1
+    return steps
+
+
+def powermake_steps(groups: T.List[Group], jobs: int, parallel_stages: bool = True) -> int:
+    # Each group runs its files in parallel, the stages run one after the other, and the groups of a stage
+    # share the jobs, or run one after the other without `parallel_stages`
+    steps = 0
+    for stage in iter_stages(group for group in groups if group.operation_type != "command"):
+        if parallel_stages:
+            steps += math.ceil(sum(len(group.files) for group in stage) / jobs)
+        else:
+            steps += sum(math.ceil(len(group.files) / jobs) for group in stage)
+    return steps
@@ -0,0 +1,94 @@
+import re
+import typing as T
+
+# Single pass tokenizer for the shell lines printed by make.
+# A line is cut on `&&` and each piece is split into words like shlex.split would do,
+# the words are kept on the Command so that later stages never parse the string again.
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+    |(?P<and>&&)
+    |'(?P<squote>[^']*)'
+    |"(?P<dquote>(?:[^"\\]|\\.)*)"
+    |\\(?P<escape>.)
+    |(?P<word>[^ \t\r\n&'"\\]+|&)
+    |(?P<error>['"\\])
+""", re.VERBOSE | re.DOTALL)
+
+_DQUOTE_ESCAPE_RE = re.compile(r'\\(["\\])')
+
+
+class Command(str):
+    # A shell command without `&&`, it's still a str so it can be used everywhere a command string is expected.
+    # `args` are the words of the command, `binary_end` is the index of the end of the first word.
+    args: T.List[str]
+    binary_end: int
+
+    def __new__(cls, text: str, args: T.List[str], binary_end: int = -1) -> "Command":
+        command = super().__new__(cls, text)
+        command.args = args
+        if binary_end < 0:
+            binary_end = len(text)
+        command.binary_end = binary_end
+        return command
+
+
+def tokenize(line: str, split_on_and: bool = True) -> T.List[Command]:
+    commands: T.List[Command] = []
+    args: T.List[str] = []
+    word: T.List[str] = []
+    in_word = False
+    binary_end = -1
+    start = 0
+    pos = 0
+    length = len(line)
+    while pos < length:
+        match = _TOKEN_RE.match(line, pos)
+        assert match is not None and match.lastgroup is not None
+        kind = match.lastgroup
+        if kind == "and" and not split_on_and:
+            kind = "word"
+        if kind == "space" or kind == "and":
+            if in_word:
+                args.append("".join(word))
+                if binary_end < 0:
+                    binary_end = match.start() - start
+                word = []
+                in_word = False
+            pos = match.end()
+            if kind == "and":
+                commands.append(Command(line[start:match.start()], args, binary_end))
+                args = []
+                binary_end = -1
+                while pos < length and line[pos] == '&':
+                    pos += 1
+                while pos < length and (line[pos] == ' ' or line[pos] == '\t'):
+                    pos += 1
+                start = pos
+            continue
+
+        if kind == "error":
+            if match.group() == '\\':
+                raise ValueError("No escaped character")
+            raise ValueError("No closing quotation")
+        if kind == "word":
+            word.append(match.group())
+        elif kind == "dquote":
+            word.append(_DQUOTE_ESCAPE_RE.sub(r"\1", match.group(kind)))
+        else:
+            word.append(match.group(kind))
+        in_word = True
+        pos = match.end()
+
+    if in_word:
+        args.append("".join(word))
+    if start < length or len(commands) == 0:
+        commands.append(Command(line[start:], args, binary_end))
+    return commands
+
+
+def parse_command(command: str) -> Command:
+    # Words of a single command, reuse the ones computed by `tokenize` if they are available
+    if isinstance(command, Command):
+        return command
+    return tokenize(command, split_on_and=False)[0]
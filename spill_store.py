@@ -0,0 +1,217 @@
+import os
+import json
+import sqlite3
+import tempfile
+import typing as T
+
+from records import OperationType, ToolCommand, ShellCommand, Group, GroupFile
+from schedule import is_barrier, library_names, linked_libraries
+
+# On-disk store of the commands of a translation, for the projects too big to have all their commands,
+# groups and objects in memory at once (--max-memory). The commands, their outputs and their inputs
+# (the dependency edges, indexed by path) are written to a temporary SQLite database as they come,
+# create_compilation_groups then places them in stages and groups them like schedule does, with indexed queries,
+# and the groups are read back one at a time by create_instructions.
+# Only the current group and the SQLite page cache are in memory, the cache takes a quarter of the cap.
+
+SCHEMA = """
+CREATE TABLE commands (id INTEGER PRIMARY KEY, operation_type TEXT NOT NULL, signature INTEGER, output TEXT, normalized TEXT, command TEXT, cwd TEXT);
+CREATE UNIQUE INDEX commands_output ON commands (output);
+CREATE INDEX commands_normalized ON commands (normalized, id);
+CREATE TABLE inputs (command INTEGER NOT NULL, position INTEGER NOT NULL, path TEXT NOT NULL, PRIMARY KEY (command, position)) WITHOUT ROWID;
+CREATE INDEX inputs_path ON inputs (path, command);
+CREATE TABLE signatures (id INTEGER PRIMARY KEY, defines TEXT NOT NULL, includedirs TEXT NOT NULL, args TEXT NOT NULL);
+CREATE UNIQUE INDEX signatures_values ON signatures (defines, includedirs, args);
+CREATE TABLE libraries (name TEXT NOT NULL, command INTEGER NOT NULL, PRIMARY KEY (name, command)) WITHOUT ROWID;
+CREATE TABLE edges (command INTEGER NOT NULL, dependency INTEGER NOT NULL, PRIMARY KEY (command, dependency)) WITHOUT ROWID;
+CREATE TABLE stages (command INTEGER PRIMARY KEY, stage INTEGER NOT NULL, height INTEGER NOT NULL);
+CREATE TABLE members (grp INTEGER NOT NULL, command INTEGER NOT NULL, PRIMARY KEY (grp, command)) WITHOUT ROWID;
+CREATE TABLE groups (id INTEGER PRIMARY KEY, operation_type TEXT NOT NULL, signature INTEGER, command TEXT, cwd TEXT, stage INTEGER NOT NULL, grouping INTEGER NOT NULL);
+CREATE INDEX groups_grouping ON groups (stage, grouping);
+CREATE TABLE objects (output TEXT PRIMARY KEY, variable INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE warnings (id INTEGER PRIMARY KEY, instruction TEXT NOT NULL);
+"""
+
+Args = T.List[T.Union[str, T.Tuple[str, ...]]]
+
+
+class SpilledObjectsVariables:
+    # The objectsN variable of each object, like the dict of create_instructions
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def get(self, output: str, default: T.Union[int, None] = None) -> T.Union[int, None]:
+        row = self.connection.execute("SELECT variable FROM objects WHERE output = ?", (output,)).fetchone()
+        return default if row is None else row[0]
+
+    def __contains__(self, output: str) -> bool:
+        return self.get(output) is not None
+
+    def __getitem__(self, output: str) -> int:
+        variable = self.get(output)
+        if variable is None:
+            raise KeyError(output)
+        return variable
+
+    def __setitem__(self, output: str, variable: int) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO objects VALUES (?, ?)", (output, variable))
+
+
+class SpilledWarnings:
+    # The instructions to verify, like the list given to create_instructions
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+    def append(self, instruction: str) -> None:
+        self.connection.execute("INSERT INTO warnings (instruction) VALUES (?)", (instruction,))
+
+    def __len__(self) -> int:
+        return T.cast(int, self.connection.execute("SELECT count(*) FROM warnings").fetchone()[0])
+
+    def __iter__(self) -> T.Iterator[str]:
+        for (instruction,) in self.connection.execute("SELECT instruction FROM warnings ORDER BY id"):
+            yield instruction
+
+
+def _args_from_json(text: str) -> Args:
+    return [tuple(arg) if isinstance(arg, list) else arg for arg in json.loads(text)]
+
+
+class SpillStore:
+    def __init__(self, max_memory: int, directory: T.Union[str, None] = None) -> None:
+        # `max_memory` in bytes, the database is removed by close()
+        self.max_memory = max_memory
+        descriptor, self.path = tempfile.mkstemp(prefix="makefile_to_powermake_", suffix=".sqlite3", dir=directory)
+        os.close(descriptor)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        # A scratch database, it's never read again after a crash
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA temp_store = FILE")
+        self.connection.execute(f"PRAGMA cache_size = -{max(1024, max_memory // 4 // 1024)}")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("BEGIN")
+        self._signatures: T.Dict[T.Tuple[T.Tuple[T.Any, ...], ...], int] = {}
+        self._signatures_values: T.Dict[int, T.Tuple[T.List[str], T.List[str], Args]] = {}
+        self.objects_variables = SpilledObjectsVariables(self.connection)
+        self.warnings = SpilledWarnings(self.connection)
+
+    def close(self) -> None:
+        self.connection.close()
+        os.remove(self.path)
+
+    def __enter__(self) -> "SpillStore":
+        return self
+
+    def __exit__(self, *args: T.Any) -> None:
+        self.close()
+
+    def _signature(self, command: ToolCommand) -> int:
+        key = (tuple(command.defines), tuple(command.includedirs), tuple(command.args))
+        # Only the last ones are kept in memory, the same flags usually come one after the other
+        if key not in self._signatures:
+            if len(self._signatures) >= 1024:
+                self._signatures.clear()
+            values = (json.dumps(command.defines), json.dumps(command.includedirs), json.dumps(command.args))
+            row = self.connection.execute("SELECT id FROM signatures WHERE defines = ? AND includedirs = ? AND args = ?", values).fetchone()
+            self._signatures[key] = T.cast(int, self.connection.execute("INSERT INTO signatures (defines, includedirs, args) VALUES (?, ?, ?)", values).lastrowid) if row is None else row[0]
+        return self._signatures[key]
+
+    def _signature_values(self, signature: int) -> T.Tuple[T.List[str], T.List[str], Args]:
+        if signature not in self._signatures_values:
+            if len(self._signatures_values) >= 1024:
+                self._signatures_values.clear()
+            defines, includedirs, args = self.connection.execute("SELECT defines, includedirs, args FROM signatures WHERE id = ?", (signature,)).fetchone()
+            self._signatures_values[signature] = (json.loads(defines), json.loads(includedirs), _args_from_json(args))
+        return self._signatures_values[signature]
+
+    def add_commands(self, commands: T.Iterable[T.Union[ToolCommand, ShellCommand]]) -> None:
+        # Like the list of create_compilation_groups, a tool command producing the output of a previous one is dropped
+        for command in commands:
+            if isinstance(command, ShellCommand):
+                self.connection.execute("INSERT INTO commands (operation_type, command, cwd) VALUES ('command', ?, ?)", (command.command, command.cwd))
+                continue
+            if command.outputfile is None:
+                continue
+            cursor = self.connection.execute("INSERT OR IGNORE INTO commands (operation_type, signature, output, normalized) VALUES (?, ?, ?, ?)", (command.operation_type, self._signature(command), command.outputfile, os.path.normpath(command.outputfile)))
+            if cursor.rowcount == 0:
+                continue
+            self.connection.executemany("INSERT INTO inputs VALUES (?, ?, ?)", ((cursor.lastrowid, position, path) for position, path in enumerate(command.inputfiles)))
+
+    def create_groups(self) -> None:
+        self._place_commands()
+        self._measure_chains()
+        self._group_commands()
+
+    def _place_commands(self) -> None:
+        # The stages of schedule_commands, in the order of make: a command is one stage after the last of the commands
+        # it depends on since the last barrier (the producers of its inputs and of the libraries it takes with -l),
+        # a barrier is alone in its stage. The producers are found with the indexes on the outputs and on the libraries.
+        segment_start = 0  # first command after the last barrier
+        first_stage = 0  # first stage after the last barrier
+        next_stage = 0  # first stage after the commands placed since the last barrier
+        for command_id, operation_type, signature, output in self.connection.execute("SELECT id, operation_type, signature, output FROM commands ORDER BY id"):
+            if is_barrier(operation_type):
+                self.connection.execute("INSERT INTO stages VALUES (?, ?, 1)", (command_id, next_stage))
+                segment_start = command_id + 1
+                first_stage = next_stage = next_stage + 1
+                continue
+            dependencies: T.Dict[int, int] = {}
+            for (path,) in self.connection.execute("SELECT path FROM inputs WHERE command = ?", (command_id,)).fetchall():
+                row = self.connection.execute("SELECT c.id, s.stage FROM commands c JOIN stages s ON s.command = c.id WHERE c.normalized = ? AND c.id >= ? AND c.id < ? ORDER BY c.id DESC LIMIT 1", (os.path.normpath(path), segment_start, command_id)).fetchone()
+                if row is not None:
+                    dependencies[row[0]] = row[1]
+            if operation_type in ("link", "shared_link"):
+                for name in linked_libraries(operation_type, self._signature_values(signature)[2]):
+                    row = self.connection.execute("SELECT l.command, s.stage FROM libraries l JOIN stages s ON s.command = l.command WHERE l.name = ? AND l.command >= ? ORDER BY l.command DESC LIMIT 1", (name, segment_start)).fetchone()
+                    if row is not None:
+                        dependencies[row[0]] = row[1]
+            stage = max(dependencies.values()) + 1 if len(dependencies) > 0 else first_stage
+            next_stage = max(next_stage, stage + 1)
+            self.connection.execute("INSERT INTO stages VALUES (?, ?, 1)", (command_id, stage))
+            self.connection.executemany("INSERT INTO edges VALUES (?, ?)", ((command_id, dependency) for dependency in dependencies))
+            if operation_type != "compile":
+                self.connection.executemany("INSERT OR IGNORE INTO libraries VALUES (?, ?)", ((name, command_id) for name in library_names(output)))
+
+    def _measure_chains(self) -> None:
+        # The height of each command, the length of the longest chain of commands starting at it. The edges are read
+        # from the last command, the height of a command is known once the edges of the ones after it are read.
+        command_id, height = None, 1
+        for command, dependency in self.connection.execute("SELECT command, dependency FROM edges ORDER BY command DESC"):
+            if command != command_id:
+                command_id = command
+                height = self.connection.execute("SELECT height FROM stages WHERE command = ?", (command,)).fetchone()[0]
+            self.connection.execute("UPDATE stages SET height = max(height, ?) WHERE command = ?", (height + 1, dependency))
+
+    def _group_commands(self) -> None:
+        # The compile commands of a stage are gathered in one group per signature, the other commands are alone.
+        # The groups are numbered in the order of schedule: by stage, the ones at the head of the longest chain first,
+        # then the biggest ones, then in the order of make.
+        grouping = "CASE WHEN c.operation_type = 'compile' THEN c.signature ELSE -c.id END"
+        for stage, group_key, operation_type, signature, command, cwd in self.connection.execute(f"SELECT s.stage, {grouping} AS grouping, c.operation_type, c.signature, c.command, c.cwd FROM commands c JOIN stages s ON s.command = c.id GROUP BY s.stage, grouping ORDER BY s.stage, max(s.height) DESC, count(*) DESC, min(c.id)"):
+            self.connection.execute("INSERT INTO groups (operation_type, signature, command, cwd, stage, grouping) VALUES (?, ?, ?, ?, ?, ?)", (operation_type, signature, command, cwd, stage, group_key))
+        self.connection.execute(f"INSERT INTO members SELECT g.id, c.id FROM commands c JOIN stages s ON s.command = c.id JOIN groups g ON g.stage = s.stage AND g.grouping = {grouping} WHERE c.operation_type != 'command'")
+        self.connection.execute("CREATE UNIQUE INDEX members_command ON members (command)")
+
+    def tool_commands_count(self) -> int:
+        return T.cast(int, self.connection.execute("SELECT count(*) FROM commands WHERE operation_type != 'command'").fetchone()[0])
+
+    def has_operation(self, operation_type: OperationType) -> bool:
+        return self.connection.execute("SELECT 1 FROM commands WHERE operation_type = ? LIMIT 1", (operation_type,)).fetchone() is not None
+
+    def iter_groups(self) -> T.Iterator[Group]:
+        # The groups are read back one at a time and split like split_partially_used_groups does:
+        # the files of a group are split according to the groups, at or after it, that use them.
+        for group_id, operation_type, signature, command, cwd, stage in self.connection.execute("SELECT id, operation_type, signature, command, cwd, stage FROM groups ORDER BY id"):
+            if operation_type == "command":
+                yield Group("command", [], [], [], [], command, cwd, stage)
+                continue
+            defines, includedirs, args = self._signature_values(signature)
+            parts: T.Dict[T.Tuple[int, ...], T.List[GroupFile]] = {}
+            for command_id, output in self.connection.execute("SELECT m.command, c.output FROM members m JOIN commands c ON c.id = m.command WHERE m.grp = ? ORDER BY m.command", (group_id,)).fetchall():
+                consumers = tuple(consumer for (consumer,) in self.connection.execute("SELECT DISTINCT m.grp FROM inputs i JOIN members m ON m.command = i.command WHERE i.path = ? AND m.grp >= ? ORDER BY m.grp", (output, group_id)))
+                dependencies = [path for (path,) in self.connection.execute("SELECT path FROM inputs WHERE command = ? ORDER BY position", (command_id,))]
+                parts.setdefault(consumers, []).append(GroupFile(dependencies, output))
+            # Looking at the consumers in order, the files a consumer doesn't use come before the ones it uses
+            for consumers in sorted(parts, key=lambda consumers: (*(-j for j in consumers), -2**62)):
+                yield Group(operation_type, defines, includedirs, args, parts[consumers], stage=stage)
@@ -0,0 +1,156 @@
+import os
+import json
+import shutil
+import typing as T
+
+import profiling
+
+# Resolution and classification of the binaries found in the commands.
+# Each binary is resolved and classified once per run, the result is also kept in an on-disk cache
+# so that the next runs with the same PATH don't need to walk it again.
+
+BinaryKind = T.Literal["compiler", "launcher", "archiver", "ranlib", "make", "cmake", "filtered", "other", "not_found"]
+
+CACHE_VERSION = 2
+default_cache_path = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "makefile_to_powermake", "toolchain.json")
+
+_cache_which: T.Dict[str, T.Union[str, None]] = {}
+def sh_which_cache(name: str) -> T.Union[str, None]:
+    if name not in _cache_which:
+        _cache_which[name] = shutil.which(name)
+    return _cache_which[name]
+
+
+_kinds: T.Dict[str, BinaryKind] = {}
+_persistent_cache: T.Union[T.Dict[str, T.List[T.Any]], None] = None
+_persistent_cache_path: T.Union[str, None] = None
+_persistent_cache_dirty = False
+_seeded: T.Set[str] = set()
+
+
+def _path_dirs_mtime() -> T.List[int]:
+    mtimes = []
+    for dir in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        try:
+            mtimes.append(os.stat(dir).st_mtime_ns)
+        except OSError:
+            mtimes.append(-1)
+    return mtimes
+
+
+def _binary_mtime(fullpath: T.Union[str, None]) -> int:
+    if fullpath is None:
+        return -1
+    try:
+        return os.stat(fullpath).st_mtime_ns
+    except OSError:
+        return -1
+
+
+def _is_persistable(name: str) -> bool:
+    # A relative path depends on the current directory, not on PATH
+    return '/' not in name or os.path.isabs(name)
+
+
+def load_cache(path: T.Union[str, None] = default_cache_path) -> None:
+    # The cached entries are only used if PATH and the mtime of its directories didn't change,
+    # each binary found is also checked against its own mtime.
+    global _persistent_cache, _persistent_cache_path
+    _persistent_cache_path = path
+    _persistent_cache = {}
+    if path is None:
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+        return
+    entry = data.get("paths", {}).get(os.environ.get("PATH", os.defpath))
+    if entry is None or entry.get("dirs_mtime") != _path_dirs_mtime():
+        return
+    _persistent_cache = entry.get("binaries", {})
+
+
+def save_cache() -> None:
+    if _persistent_cache_path is None or _persistent_cache is None or not _persistent_cache_dirty:
+        return
+    try:
+        with open(_persistent_cache_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            raise ValueError()
+    except (OSError, ValueError):
+        data = {"version": CACHE_VERSION, "paths": {}}
+    path_variable = os.environ.get("PATH", os.defpath)
+    dirs_mtime = _path_dirs_mtime()
+    binaries = _persistent_cache
+    saved = data["paths"].get(path_variable)
+    if isinstance(saved, dict) and saved.get("dirs_mtime") == dirs_mtime:
+        # Keep the binaries found in the meantime by the other translators (see the batch mode of main.py)
+        binaries = {**saved.get("binaries", {}), **_persistent_cache}
+    data["paths"][path_variable] = {"dirs_mtime": dirs_mtime, "binaries": binaries}
+
+    os.makedirs(os.path.dirname(_persistent_cache_path), exist_ok=True)
+    # Written in a temporary file then renamed, several translators can share the cache
+    tmp_path = f"{_persistent_cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, _persistent_cache_path)
+
+
+def _classify_fullpath(fullpath: T.Union[str, None]) -> BinaryKind:
+    if fullpath is None:
+        return "not_found"
+    if fullpath == sh_which_cache("make"):
+        return "make"
+    if fullpath == sh_which_cache("cmake"):
+        return "cmake"
+    if fullpath.endswith(("-gcc", "/gcc", "-g++", "/g++", "-clang", "/clang", "-clang++", "/clang++", "-cc", "/cc", "-c++", "/c++")):
+        return "compiler"
+    if fullpath.endswith(("/ccache", "/sccache", "/distcc", "/icecc")):
+        # Compiler launchers, the compiler is their first argument
+        return "launcher"
+    if fullpath.endswith(("-ar", "/ar")):
+        return "archiver"
+    if fullpath.endswith(("-ranlib", "/ranlib")):
+        return "ranlib"
+    if fullpath in (sh_which_cache("mkdir"), sh_which_cache("echo"), sh_which_cache("printf")):
+        # PowerMake will do most of them anyway
+        return "filtered"
+    return "other"
+
+
+def binary_kind(name: str) -> BinaryKind:
+    global _persistent_cache_dirty
+    if name in _kinds:
+        return _kinds[name]
+
+    if _persistent_cache is None:
+        load_cache(None)
+    assert _persistent_cache is not None
+
+    if name not in _cache_which and name in _persistent_cache:
+        fullpath, kind, mtime = _persistent_cache[name]
+        if _binary_mtime(fullpath) == mtime:
+            _cache_which[name] = fullpath
+            _kinds[name] = kind
+            return kind
+
+    with profiling.phase("toolchain"):
+        fullpath = sh_which_cache(name)
+        kind = _classify_fullpath(fullpath)
+    _kinds[name] = kind
+    mtime = _binary_mtime(fullpath)
+    if _is_persistable(name) and name not in _seeded and (fullpath is None or mtime != -1):
+        _persistent_cache[name] = [fullpath, kind, mtime]
+        _persistent_cache_dirty = True
+    return kind
+
+
+def seed(which: T.Dict[str, T.Union[str, None]]) -> None:
+    # Use the given resolutions instead of the ones of this machine (for example the ones recorded in a trace)
+    _cache_which.update(which)
+    _seeded.update(which)
+    _kinds.clear()